@@ -17,24 +17,34 @@
 
 """Singularity launch script for AlphaFold 3 Singularity image."""
 
+import concurrent.futures
+import contextlib
+import glob
+import hashlib
+import importlib.util
+import json
 import os
 import sys
 import pathlib
+import shutil
 import signal
-from typing import List, Tuple, Optional
+import string
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
 import multiprocessing
 
 from absl import app
 from absl import flags
 from absl import logging
-try:
-    from spython.main import Client
-except ImportError:
-    print("Error: spython library not found. Please install it: pip install spython")
-    sys.exit(1)
 
 import tempfile
 
+# Helpers shared by all launchers live in <repo>/common.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from launcher_utils import coalesce_binds, create_bind, load_image, make_host_dirs, normalize_path, remap_arg
+
 #### USER CONFIGURATION ####
 
 # --- Define the location of your AlphaFold 3 Singularity image ---
@@ -45,18 +55,6 @@ if 'ALPHAFOLD3_SIF' in os.environ:
 else:
     _ALPHAFOLD3_SIF_PATH = '/path/to/your/alphafold3.sif'  # PLEASE UPDATE THIS
 
-# Check if the configured SIF path exists
-if not os.path.exists(_ALPHAFOLD3_SIF_PATH):
-    print(f"Error: Singularity image not found at '{_ALPHAFOLD3_SIF_PATH}'.")
-    print("Please set the ALPHAFOLD3_SIF environment variable or update the _ALPHAFOLD3_SIF_PATH in this script.")
-    sys.exit(1)
-
-try:
-    singularity_image = Client.load(_ALPHAFOLD3_SIF_PATH)
-except Exception as e:
-    print(f"Error loading Singularity image '{_ALPHAFOLD3_SIF_PATH}': {e}")
-    sys.exit(1)
-
 # --- Temporary directory ---
 if 'TMP' in os.environ:
     tmp_dir = os.environ['TMP']
@@ -69,17 +67,15 @@ else:
 # A subdirectory will be created within this for each run based on input name.
 output_dir_default = os.path.join(os.getcwd(), 'alphafold3_output')
 
-logging.info(f'INFO: Using Singularity image: {_ALPHAFOLD3_SIF_PATH}')
-logging.info(f'INFO: Host temporary directory: {tmp_dir}')
-logging.info(f'INFO: Default base output directory: {output_dir_default}')
-
 #### END USER CONFIGURATION ####
 
 # --- Define Command Line Flags ---
-flags.DEFINE_string(
+flags.DEFINE_list(
     'json_path', None,
-    'Path to a single JSON file containing the prediction input specification. '
-    'See AlphaFold 3 documentation for format details.')
+    'Path to a JSON file containing the prediction input specification, or a '
+    'comma separated list of them. Several files are run like an --input_dir '
+    '(one container for all of them, or spread over the GPUs). See AlphaFold 3 '
+    'documentation for format details.')
 flags.DEFINE_string(
     'input_dir', None,
     'Path to a directory containing multiple JSON input files. If specified, '
@@ -104,26 +100,86 @@ flags.DEFINE_list(
     'multiple times (e.g., for SSD fallback). The order matters: '
     'databases found in earlier directories are used preferentially. '
     'Example: --db_dir=/path/to/ssd/dbs --db_dir=/path/to/hdd/dbs')
+flags.DEFINE_string(
+    'msa_cache_dir', None,
+    'Optional host directory caching MSAs by protein sequence (SHA-256 of the '
+    'sequence, --max_template_date and --db_dir). Protein chains found in the '
+    'cache get their unpairedMsa/pairedMsa (and templates) filled in before '
+    'the run, so their genetic search is skipped; MSAs computed by the run '
+    'are added to the cache afterwards (user-supplied MSAs are not cached).')
+flags.DEFINE_boolean(
+    'prewarm_db', False,
+    'Ask the kernel to start reading the sequence databases (.fa/.fasta files '
+    'in --db_dir) into the page cache as soon as the launcher starts, so the '
+    'reads overlap with container start-up instead of stalling the first '
+    'genetic search.')
+flags.DEFINE_boolean(
+    'no_container_data_pipeline', False,
+    'Run the CPU-only data pipeline stage with the host Python instead of in '
+    'a container, keeping the container for inference. Only applies where the '
+    'data pipeline runs separately: --pipeline_mode=split or data, or '
+    '--norun_inference. Needs the alphafold3 package and the HMMER tools '
+    '(jackhmmer etc.) installed on the host, and --host_run_alphafold; '
+    'otherwise the container is used.')
+flags.DEFINE_string(
+    'host_run_alphafold', None,
+    'Path of AlphaFold 3\'s run_alphafold.py on the host, for '
+    '--no_container_data_pipeline.')
 flags.DEFINE_boolean(
     'use_gpu', True, 'Enable NVIDIA runtime (--nv flag) to run with GPUs.')
 flags.DEFINE_string(
     'gpu_devices', 'all',
-    'Comma separated list of GPU devices to pass to NVIDIA_VISIBLE_DEVICES '
-    'environment variable inside the container.')
+    'Comma separated list of GPU devices the container may use, passed as '
+    'CUDA_VISIBLE_DEVICES (plain --nv exposes every GPU and ignores '
+    'NVIDIA_VISIBLE_DEVICES, which is also set for --nvccli setups). With '
+    '--input_dir and more than one GPU, the JSON files are spread over the '
+    'GPUs, one container per GPU at a time; "all" uses every GPU listed by '
+    'nvidia-smi -L.')
+flags.DEFINE_enum(
+    'pipeline_mode', 'both', ['both', 'data', 'inference', 'split'],
+    'How to run the two AlphaFold 3 stages. "both": one container per job, '
+    'following --run_data_pipeline/--run_inference. "data" or "inference": '
+    'run only that stage. "split": run the data pipeline in CPU-only '
+    'containers and queue each finished job for inference on the GPUs, so '
+    'MSA search for later jobs overlaps inference of earlier ones (per-stage '
+    'logs go to <output_dir>/logs; each job\'s <output_dir>/<name> must be '
+    'empty unless --force_output_dir is set). Split mode needs single-job '
+    'AlphaFold 3 inputs with a "name", not AlphaFold Server job lists.')
+flags.DEFINE_boolean(
+    'persistent_instance', None,
+    'When a launch runs several containers (multiple GPUs with --input_dir, '
+    'or --pipeline_mode=split), start one Singularity instance with all binds '
+    'and exec every job into it instead of starting a container per job. '
+    'Defaults to true when --input_dir is set.')
+flags.DEFINE_integer(
+    'numa_node', None,
+    'If set, run the containers on the CPUs of this NUMA node and allocate '
+    'their memory there (via numactl --membind), so the HMMER threads never '
+    'read the databases across sockets.', lower_bound=0)
+flags.DEFINE_string(
+    'cpu_set', None,
+    'CPUs to run the containers on, as a list such as "0-15,32-47". "auto" '
+    'gives each concurrently running job (multiple GPUs with --input_dir, or '
+    '--pipeline_mode=split) its own contiguous slice of the available CPUs.')
 flags.DEFINE_boolean(
     'run_data_pipeline', True,
     'Run the data pipeline (genetic search, template search). Set to false '
-    'if MSAs/templates are precomputed or provided in the input JSON.')
+    'if MSAs/templates are precomputed or provided in the input JSON. Only '
+    'used with --pipeline_mode=both.')
 flags.DEFINE_boolean(
     'run_inference', True,
     'Run the inference pipeline (requires GPU if use_gpu=True). Set to false '
-    'to only run the data pipeline.')
+    'to only run the data pipeline. Only used with --pipeline_mode=both.')
 flags.DEFINE_integer(
-    'jackhmmer_n_cpu', min(multiprocessing.cpu_count(), 8),
-    'Number of CPUs to use for Jackhmmer inside the container.')
+    'jackhmmer_n_cpu', None,
+    'Number of CPUs to use for Jackhmmer inside the container. The data '
+    'pipeline runs up to 4 Jackhmmer searches at once, each with this many '
+    'CPUs. Default: the host CPUs (minus 2) shared among the searches of all '
+    'concurrently running jobs, clamped to 2..8.', lower_bound=1)
 flags.DEFINE_integer(
-    'nhmmer_n_cpu', min(multiprocessing.cpu_count(), 8),
-    'Number of CPUs to use for Nhmmer inside the container.')
+    'nhmmer_n_cpu', None,
+    'Number of CPUs to use for Nhmmer inside the container. Default: derived '
+    'like --jackhmmer_n_cpu.', lower_bound=1)
 flags.DEFINE_string(
     'max_template_date', '2021-09-30',
     'Maximum template release date to consider (Format: YYYY-MM-DD). Also affects '
@@ -148,7 +204,20 @@ flags.DEFINE_enum(
     'flash_attention_implementation',
     default='triton',
     enum_values=['triton', 'cudnn', 'xla'],
-    help='Flash attention implementation to use inside the container (triton/cudnn require Ampere+ GPU).')
+    help='Flash attention implementation to use inside the container (triton/cudnn require Ampere+ GPU). '
+    'If not given, "triton" is used when all selected GPUs are Ampere or newer '
+    '(per nvidia-smi), otherwise "xla".')
+flags.DEFINE_string(
+    'xla_cache_dir', os.path.join('~', '.cache', 'alphafold3_xla'),
+    'Host directory for the persistent JAX/XLA compilation cache '
+    '(JAX_COMPILATION_CACHE_DIR in the container), so kernels compiled by one '
+    'run are reused by later runs with the same input shapes. Set to an empty '
+    'string to disable.')
+flags.DEFINE_float(
+    'xla_mem_fraction', None,
+    'If set, the fraction of GPU memory JAX preallocates '
+    '(XLA_PYTHON_CLIENT_MEM_FRACTION). By default the image\'s setting is used.',
+    lower_bound=0.0, upper_bound=1.0)
 flags.DEFINE_boolean(
     'save_embeddings', False,
     'Whether to save the final trunk single and pair embeddings in the output.')
@@ -158,96 +227,984 @@ FLAGS = flags.FLAGS
 _ROOT_MOUNT_DIRECTORY = '/mnt/'
 
 
-def _create_bind(mount_point_name: str, host_path: str, is_dir: bool = True) -> Tuple[str, str]:
-    """Create a bind mount specification for Singularity.
+def _create_bind(mount_point_name: str, host_path: str, is_dir: bool = True,
+                 pending_dirs: Optional[List[str]] = None) -> Tuple[str, str]:
+    """Create an AlphaFold 3 bind mount under _ROOT_MOUNT_DIRECTORY (see launcher_utils.create_bind).
+
+    Output, tmp and XLA cache directories are created on the host if missing (via
+    pending_dirs, if given); every other host path must already exist.
+    """
+    create = mount_point_name.startswith('output') or mount_point_name in ('tmp', 'xla_cache')
+    return create_bind(_ROOT_MOUNT_DIRECTORY + mount_point_name, mount_point_name, normalize_path(host_path),
+                       is_dir=is_dir, create=create, pending_dirs=pending_dirs)
+
+
+def _database_files(db_dirs: List[str]) -> List[str]:
+    """Return the sequence database files (.fa/.fasta) directly inside db_dirs.
+
+    Like the data pipeline, a file name found in an earlier directory shadows
+    the same name in later ones. The template mmCIF directory is not included.
+    """
+    files = {}
+    for db_dir in db_dirs:
+        try:
+            with os.scandir(db_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(('.fa', '.fasta')) and entry.is_file():
+                        files.setdefault(entry.name, entry.path)
+        except OSError as e:
+            logging.warning('Could not list database directory %s: %s', db_dir, e)
+    return list(files.values())
+
+
+def _prewarm(paths: List[str]) -> None:
+    """Ask the kernel to read paths into the page cache (POSIX_FADV_WILLNEED).
+
+    No data is copied into the launcher; the kernel reads the files ahead so
+    the HMMER searches in the container find them cached.
+    """
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            logging.warning('Could not prewarm %s: %s', path, e)
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError as e:
+            logging.warning('Could not prewarm %s: %s', path, e)
+        finally:
+            os.close(fd)
+    logging.info('Requested page cache prefetch of %d database files', len(paths))
+
+
+def _host_cpu_count() -> int:
+    """Return the number of CPUs available to the launcher.
+
+    Under Slurm/cgroup cpusets (or --numa_node/--cpu_set) this is the
+    allocation, not the node total that multiprocessing.cpu_count() reports.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def _default_msa_cpus(concurrent_jobs: int) -> int:
+    """Threads per MSA tool when concurrent_jobs data pipelines run at once."""
+    share = (_host_cpu_count() - _RESERVED_CPUS) // (_CONCURRENT_MSA_SEARCHES * concurrent_jobs)
+    return max(_MIN_MSA_CPUS, min(_MAX_MSA_CPUS, share))
+
+
+def _split_data_workers(n_jobs: int, msa_cpus: int) -> int:
+    """Data pipeline jobs that fit the host at once with msa_cpus threads per MSA tool.
+
+    Used both to derive the --jackhmmer_n_cpu default and to size the split-mode
+    data pool, so the two agree and _RESERVED_CPUS stay free.
+    """
+    fit = (_host_cpu_count() - _RESERVED_CPUS) // (_CONCURRENT_MSA_SEARCHES * msa_cpus)
+    return max(1, min(n_jobs, fit))
+
+
+def _resolve_gpu_ids(gpu_devices: str) -> List[str]:
+    """Expand --gpu_devices into a list of individual device ids.
 
     Args:
-        mount_point_name: A descriptive name for the mount point (used for target path).
-        host_path: The absolute path on the host system.
-        is_dir: Whether the host_path is a directory.
+        gpu_devices: The --gpu_devices value ('all' or a comma separated list).
 
     Returns:
-        A tuple containing:
-          - The bind string for Singularity ('host_path:target_path').
-          - The corresponding path inside the container.
+        The device ids. For 'all' the GPUs listed by 'nvidia-smi -L' are used;
+        if they cannot be listed, ['all'] is returned (no sharding).
+    """
+    if gpu_devices != 'all':
+        return [gpu.strip() for gpu in gpu_devices.split(',') if gpu.strip()]
+    try:
+        listing = subprocess.run(['nvidia-smi', '-L'], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning('Could not list GPUs with nvidia-smi (%s); using all GPUs in one container.', e)
+        return ['all']
+    gpu_ids = [str(i) for i, line in enumerate(listing.splitlines()) if line.startswith('GPU ')]
+    return gpu_ids or ['all']
+
+
+# Result of _autodetect_flash_impl(), probed at most once per launch.
+_detected_flash_impl = None
+
+
+def _autodetect_flash_impl(gpu_devices: str) -> str:
+    """Pick the flash attention implementation the launch's GPUs support.
+
+    Triton (the AlphaFold 3 default) needs compute capability 8.0 (Ampere) or
+    newer; older GPUs must use the XLA implementation. If nvidia-smi cannot be
+    queried, 'triton' is kept.
+
+    Args:
+        gpu_devices: The --gpu_devices value ('all' or a comma separated list).
+
+    Returns:
+        'triton' if every selected GPU is sm_80 or newer, otherwise 'xla'.
+    """
+    global _detected_flash_impl
+    if _detected_flash_impl is not None:
+        return _detected_flash_impl
+    query = ['nvidia-smi', '--query-gpu=compute_cap', '--format=csv,noheader']
+    if gpu_devices != 'all':
+        query.append(f'--id={gpu_devices}')
+    try:
+        output = subprocess.run(query, capture_output=True, text=True, check=True).stdout
+        compute_caps = [tuple(int(part) for part in line.strip().split('.')) for line in output.splitlines() if line.strip()]
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        logging.warning('Could not query GPU compute capability (%s); keeping the triton flash attention.', e)
+        compute_caps = []
+    _detected_flash_impl = 'xla' if any(cap < (8, 0) for cap in compute_caps) else 'triton'
+    logging.info('GPU compute capabilities %s: using --flash_attention_implementation=%s',
+                 ', '.join('.'.join(map(str, cap)) for cap in compute_caps) or 'unknown', _detected_flash_impl)
+    return _detected_flash_impl
+
+
+def _list_jsons(input_dir: str) -> List[str]:
+    """Return the names of the .json files directly inside input_dir, sorted.
+
+    Uses a single os.scandir pass; the directory entries already carry the file
+    type, so no per-entry stat is needed.
+    """
+    with os.scandir(input_dir) as entries:
+        return sorted(entry.name for entry in entries if entry.name.endswith('.json') and entry.is_file())
+
+
+def _link_inputs(json_paths: List[str]) -> str:
+    """Gather the --json_path files into a new directory under the tmp dir.
+
+    The directory is then run as an --input_dir. The files are hard-linked (or
+    copied if that fails, e.g. across file systems) rather than symlinked, since
+    a symlink's target is not bound into the container.
+
+    Returns:
+        The new directory; the caller removes it.
+    """
+    names = [os.path.basename(path) for path in json_paths]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise app.UsageError(f'--json_path files must have distinct names: {", ".join(duplicates)}')
+    os.makedirs(normalize_path(tmp_dir), exist_ok=True) # Before _create_bind would create it
+    link_dir = tempfile.mkdtemp(prefix='alphafold3_inputs_', dir=normalize_path(tmp_dir))
+    for path, name in zip(json_paths, names):
+        try:
+            os.link(path, os.path.join(link_dir, name))
+        except OSError:
+            shutil.copy2(path, os.path.join(link_dir, name))
+    return link_dir
+
+
+def _check_input_json(json_path: str) -> Optional[str]:
+    """Return why json_path is not a usable AlphaFold 3 input, or None if it is.
+
+    Only the top-level structure is checked (an AlphaFold 3 input object, or a
+    list of AlphaFold Server jobs); run_alphafold.py validates the rest.
+    """
+    try:
+        with open(json_path) as f:
+            fold_input = json.load(f)
+    except (OSError, ValueError) as e:
+        return str(e)
+    if isinstance(fold_input, dict):
+        if not isinstance(fold_input.get('sequences'), list):
+            return 'missing a "sequences" list'
+    elif not isinstance(fold_input, list):
+        return 'expected a JSON object or a list of jobs'
+    return None
+
+
+def _singularity_options(bind_arg: Optional[str], gpu_devices: str,
+                         container_env: Tuple[str, ...] = ()) -> List[str]:
+    """Build the Singularity options shared by every container invocation.
+
+    bind_arg is the joined --bind value from _launch; it is None for an exec
+    into a persistent instance, which already has its binds. container_env
+    holds extra 'NAME=value' variables (see _build_common_binds).
+
+    Plain --nv makes every host GPU visible and only the nvidia-container-cli
+    path (--nvccli) reads NVIDIA_VISIBLE_DEVICES, so the devices are also
+    restricted with CUDA_VISIBLE_DEVICES. That works per exec as well, so jobs
+    exec'd into one persistent instance still each get their own GPU.
+    """
+    options = (['--bind', bind_arg] if bind_arg else []) + [
+        '--env', f'NVIDIA_VISIBLE_DEVICES={gpu_devices}',
+        # Add performance-related env vars if needed (might depend on GPU/setup)
+        # '--env', 'TF_FORCE_UNIFIED_MEMORY=1',
+    ]
+    if gpu_devices != 'all':
+        options += ['--env', f'CUDA_VISIBLE_DEVICES={gpu_devices}']
+    for variable in container_env:
+        options += ['--env', variable]
+    return options
+
+
+# The AlphaFold 3 data pipeline already runs the genetic searches of a chain
+# concurrently (up to 4 jackhmmer runs for a protein chain: uniref90, mgnify,
+# small BFD and UniProt), each with --jackhmmer_n_cpu threads.
+_CONCURRENT_MSA_SEARCHES = 4
+
+# Bounds for the derived --jackhmmer_n_cpu/--nhmmer_n_cpu defaults. The HMMER
+# tools stop scaling at about 8 threads, and a couple of cores are left for the
+# launcher and the rest of the pipeline.
+_MIN_MSA_CPUS = 2
+_MAX_MSA_CPUS = 8
+_RESERVED_CPUS = 2
+
+# How much of a failed job's log to show on the terminal (see _log_tail).
+_LOG_TAIL_LINES = 20
+_LOG_TAIL_BYTES = 16384
+
+# --run_data_pipeline / --run_inference values for the stages of --pipeline_mode.
+_PIPELINE_STAGES = {
+    'data': (True, False),
+    'inference': (False, True),
+}
+
+# GPU assigned to the current worker process by _init_worker.
+_worker_gpu_id = None
+
+
+def _parse_cpu_list(cpu_list: str) -> Set[int]:
+    """Parse a CPU list such as '0-7,16-23' (the cpuset/taskset syntax)."""
+    cpus = set()
+    for part in cpu_list.split(','):
+        first, _, last = part.strip().partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _numa_node_cpus(numa_node: int) -> Set[int]:
+    """Return the CPUs of a NUMA node, as listed in sysfs."""
+    with open(f'/sys/devices/system/node/node{numa_node}/cpulist') as f:
+        return _parse_cpu_list(f.read())
+
+
+def _cpu_slices(n_workers: int) -> Optional[List[Set[int]]]:
+    """Split the launcher's CPUs into n_workers contiguous slices for --cpu_set=auto.
+
+    Returns:
+        One CPU set per worker, or None if --cpu_set is not 'auto'.
+    """
+    if FLAGS.cpu_set != 'auto':
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    size = max(1, len(cpus) // n_workers)
+    # With more workers than CPUs, the slices wrap around and are shared
+    return [set(cpus[(i * size) % len(cpus):][:size]) for i in range(n_workers)]
+
+
+def _init_worker(gpu_queue, cpu_queue) -> None:
+    """Give each pool worker its own GPU and/or CPU slice (either queue may be None).
+
+    The CPU slice is applied with sched_setaffinity, so the worker's containers
+    inherit it.
+    """
+    global _worker_gpu_id
+    if gpu_queue is not None:
+        _worker_gpu_id = gpu_queue.get()
+    if cpu_queue is not None:
+        os.sched_setaffinity(0, cpu_queue.get())
+
+
+def _worker_pool(n_workers: int, gpu_ids: Optional[List[str]] = None,
+                 cpu_slices: Optional[List[Set[int]]] = None) -> concurrent.futures.ProcessPoolExecutor:
+    """Create a process pool whose workers each own one of gpu_ids and/or cpu_slices.
+
+    Args:
+        n_workers: Number of worker processes.
+        gpu_ids: If given, one GPU id per worker (see _run_one).
+        cpu_slices: If given, one CPU set per worker (see _cpu_slices).
+    """
+    queues = []
+    for items in (gpu_ids, cpu_slices):
+        if items is None:
+            queues.append(None)
+            continue
+        queue = multiprocessing.Queue()
+        for item in items:
+            queue.put(item)
+        queues.append(queue)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                                  initargs=tuple(queues))
+
+
+def _start_instance(name: str, bind_arg: str, use_gpu: bool) -> str:
+    """Start a Singularity instance of the AlphaFold 3 image with all binds.
+
+    Jobs then exec into it (see _run_stage), so the image is mounted and the
+    binds are set up once for the whole batch instead of once per container.
+
+    Args:
+        name: Name of the instance.
+        bind_arg: The comma-separated Singularity bind list.
+        use_gpu: Whether to start the instance with --nv.
+
+    Returns:
+        The instance URI ('instance://<name>'); pass it to _stop_instance when done.
+
+    Raises:
+        OSError, subprocess.CalledProcessError: If the instance could not be started.
+    """
+    command = ['singularity', 'instance', 'start'] + (['--nv'] if use_gpu else []) + [
+        '--bind', bind_arg, _ALPHAFOLD3_SIF_PATH, name]
+    logging.info('Starting Singularity instance: %s', ' '.join(command))
+    subprocess.run(command, check=True)
+    return f'instance://{name}'
+
+
+def _stop_instance(instance_uri: str) -> None:
+    """Stop an instance started by _start_instance."""
+    logging.info('Stopping Singularity instance %s', instance_uri)
+    name = instance_uri[len('instance://'):]
+    if subprocess.run(['singularity', 'instance', 'stop', name], check=False).returncode != 0:
+        logging.warning('Could not stop Singularity instance %s', name)
+
+
+@contextlib.contextmanager
+def _instance_running(instance_uri: str):
+    """Stop instance_uri when the block exits, including on SIGTERM or SIGHUP.
+
+    Those signals would otherwise end the launcher without running any
+    finally blocks, leaving the instance (and its GPUs) in use. The handler
+    stops the instance first, so jobs running in it end and the worker pools
+    can shut down, then raises SystemExit.
     """
-    host_path = os.path.abspath(host_path)
-    target_base = os.path.join(_ROOT_MOUNT_DIRECTORY, mount_point_name)
+    owner_pid = os.getpid()
+    stopped = False
+
+    def _on_signal(signum, frame):
+        nonlocal stopped
+        if os.getpid() == owner_pid and not stopped: # Not in forked pool workers
+            stopped = True
+            _stop_instance(instance_uri)
+        raise SystemExit(128 + signum)
+
+    previous = {signum: signal.signal(signum, _on_signal) for signum in (signal.SIGTERM, signal.SIGHUP)}
+    try:
+        yield
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+        if not stopped:
+            _stop_instance(instance_uri)
 
-    if is_dir:
-        source_path = host_path
-        target_path = target_base
-        container_path = target_path
+
+def _run_stage(stage: Tuple[bool, bool], input_args: List[str], full_command: List[str],
+               bind_arg: Optional[str], use_gpu: bool, gpu_devices: str,
+               log_path: Optional[str] = None, instance_uri: Optional[str] = None,
+               numa_node: Optional[int] = None, container_env: Tuple[str, ...] = (),
+               host_pipeline: Optional[Tuple[List[str], Dict[str, str]]] = None) -> bool:
+    """Run one run_alphafold.py invocation in the container.
+
+    Args:
+        stage: The (run_data_pipeline, run_inference) pair for this invocation.
+        input_args: The --json_path or --input_dir argument(s).
+        full_command: The run_alphafold.py command line, without input or stage arguments.
+        bind_arg: The comma-separated Singularity bind list, joined once per
+            launch in _launch and shared by every job.
+        use_gpu: Whether GPUs may be used. --nv is only passed when the stage
+            runs inference; the data pipeline is CPU-only.
+        gpu_devices: The GPUs the container may use ('all' or a comma separated
+            list), see _singularity_options.
+        log_path: If set, the container output is written to this host file
+            instead of the terminal (so concurrent jobs do not interleave).
+        instance_uri: If set ('instance://<name>'), exec into this running
+            instance; bind_arg and use_gpu were already applied when it started.
+        numa_node: If set, run under 'numactl --membind' so memory is allocated
+            on this NUMA node (the CPUs were restricted to it in main()).
+        container_env: Extra 'NAME=value' environment variables for the container.
+        host_pipeline: If set, (host command prefix, container-to-host path
+            mapping) from _host_data_pipeline; a data-pipeline-only stage then
+            runs on the host instead of in the container.
+
+    Returns:
+        Whether the container command succeeded.
+    """
+    run_data_pipeline, run_inference = stage
+    command = full_command + input_args + [
+        f'--run_data_pipeline={str(run_data_pipeline).lower()}',
+        f'--run_inference={str(run_inference).lower()}',
+    ]
+    if host_pipeline and not run_inference:
+        # Same arguments, with the container paths mapped back to the host
+        host_prefix, host_remap = host_pipeline
+        command = host_prefix + [remap_arg(arg, host_remap) for arg in command[2:]]
+        exec_command = command
+        if log_path is None:
+            logging.info('Running the data pipeline on the host: %s', ' '.join(command))
     else:
-        source_path = os.path.dirname(host_path)
-        target_path = target_base
-        container_path = os.path.join(target_path, os.path.basename(host_path))
+        if instance_uri:
+            image = instance_uri
+            options = _singularity_options(None, gpu_devices, container_env)
+            nv = False
+        else:
+            image = _ALPHAFOLD3_SIF_PATH
+            options = _singularity_options(bind_arg, gpu_devices, container_env)
+            nv = use_gpu and run_inference
+        exec_command = ['singularity', 'exec'] + (['--nv'] if nv else []) + options + [image] + command
+        if log_path is None:
+            logging.info('Running Singularity command:')
+            logging.info('Image: %s', image)
+            logging.info('Options: %s', options)
+            logging.info('Command: %s', ' '.join(command))
+    if numa_node is not None:
+        exec_command = ['numactl', f'--membind={numa_node}'] + exec_command
 
-    # Create target directory on host if it doesn't exist for output/tmp
-    if mount_point_name.startswith('output') or mount_point_name == 'tmp':
-       os.makedirs(source_path, exist_ok=True)
+    # The container writes straight to our stdout/stderr (or the log file), so
+    # its output is never read and re-printed line by line in Python.
+    with (open(log_path, 'w') if log_path else contextlib.nullcontext()) as log_file:
+        try:
+            returncode = subprocess.run(
+                exec_command,
+                stdout=log_file,
+                stderr=subprocess.STDOUT if log_file else None,
+                check=False,
+            ).returncode
+        except OSError as e:
+            error = f'Error executing Singularity command: {e}'
+        else:
+            if returncode == 0:
+                return True
+            error = f'Singularity command exited with status {returncode}'
+        if log_file:
+            log_file.write(error + '\n')
+        else:
+            logging.error(error)
+    return False
 
-    bind_spec = f'{source_path}:{target_path}'
-    logging.info('Binding %s -> %s', source_path, target_path)
-    return (bind_spec, container_path)
 
+def _run_one(json_name: str, container_json_path: str, stage: Tuple[bool, bool],
+             full_command: List[str], bind_arg: Optional[str], use_gpu: bool,
+             log_path: str, instance_uri: Optional[str] = None,
+             numa_node: Optional[int] = None, container_env: Tuple[str, ...] = (),
+             host_pipeline: Optional[Tuple[List[str], Dict[str, str]]] = None) -> Tuple[str, str, bool]:
+    """Run one stage of AlphaFold 3 on one input JSON on the worker's GPU.
 
-def main(argv):
-    if len(argv) > 1:
-        raise app.UsageError('Too many command-line arguments.')
+    Args:
+        json_name: File name of the input JSON (used in messages).
+        container_json_path: Path of the input JSON inside the container.
+        stage: The (run_data_pipeline, run_inference) pair, see _run_stage.
+        full_command: The run_alphafold.py command line, without input or stage arguments.
+        bind_arg: The comma-separated Singularity bind list, see _run_stage.
+        use_gpu: Whether to pass --nv to Singularity for inference.
+        log_path: Host file that receives the job's output.
+        instance_uri: Optional persistent instance to exec into, see _run_stage.
+        numa_node: Optional NUMA node for memory allocation, see _run_stage.
+        container_env: Extra container environment variables, see _run_stage.
+        host_pipeline: Optional host data pipeline, see _run_stage.
 
-    if not FLAGS.json_path and not FLAGS.input_dir:
-        raise app.UsageError('Either --json_path or --input_dir must be specified.')
-    if FLAGS.json_path and FLAGS.input_dir:
-        logging.warning('--input_dir specified, ignoring --json_path.')
-    if not FLAGS.model_dir:
-        raise app.UsageError('--model_dir must be specified.')
-    if not FLAGS.db_dir:
-        raise app.UsageError('--db_dir must be specified (can be provided multiple times).')
+    Returns:
+        A tuple of (json_name, GPU id, whether the job succeeded).
+    """
+    ok = _run_stage(stage, [f'--json_path={container_json_path}'], full_command, bind_arg,
+                    use_gpu, _worker_gpu_id, log_path, instance_uri, numa_node, container_env,
+                    host_pipeline)
+    return (json_name, _worker_gpu_id, ok)
 
-    # --- Prepare Singularity Bind Mounts ---
-    binds = []
-    command_args = [] # Arguments for the internal run_alphafold.py
 
-    # Input JSON path or directory
-    container_json_path = None
-    container_input_dir = None
-    if FLAGS.input_dir:
-        bind_spec, container_input_dir = _create_bind('input_dir', FLAGS.input_dir, is_dir=True)
-        binds.append(bind_spec)
-        command_args.append(f'--input_dir={container_input_dir}')
-    elif FLAGS.json_path:
-        bind_spec, container_json_path = _create_bind('json_input', FLAGS.json_path, is_dir=False)
-        binds.append(bind_spec)
-        command_args.append(f'--json_path={container_json_path}')
+def _log_tail(log_path: str, n_lines: int = _LOG_TAIL_LINES) -> str:
+    """Return the last n_lines of a job log, for reporting a failed job.
+
+    Only the end of the file is read, however large the log has grown.
+    """
+    try:
+        with open(log_path, 'rb') as log_file:
+            log_file.seek(0, os.SEEK_END)
+            log_file.seek(max(0, log_file.tell() - _LOG_TAIL_BYTES))
+            tail = log_file.read()
+    except OSError as e:
+        return f'(could not read the log: {e})'
+    return b'\n'.join(tail.splitlines()[-n_lines:]).decode(errors='replace')
+
+
+def _run_sharded(json_names: List[str], container_input_dir: str, stage: Tuple[bool, bool],
+                 full_command: List[str], bind_arg: Optional[str], gpu_ids: List[str],
+                 log_dir: str, instance_uri: Optional[str] = None,
+                 container_env: Tuple[str, ...] = (),
+                 host_pipeline: Optional[Tuple[List[str], Dict[str, str]]] = None) -> List[str]:
+    """Run one container per input JSON, with at most one job per GPU at a time.
+
+    Each pool worker owns one GPU, so a job starts as soon as any GPU is free.
+
+    Returns:
+        The names of the JSON files whose job failed.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    failed = []
+    with _worker_pool(len(gpu_ids), gpu_ids, _cpu_slices(len(gpu_ids))) as executor:
+        futures = [
+            executor.submit(_run_one, name, f'{container_input_dir}/{name}', stage, full_command, bind_arg,
+                            FLAGS.use_gpu, os.path.join(log_dir, f'{os.path.splitext(name)[0]}.log'),
+                            instance_uri, FLAGS.numa_node, container_env, host_pipeline)
+            for name in json_names
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            name, gpu_id, ok = future.result()
+            if ok:
+                logging.info('Finished %s on GPU %s', name, gpu_id)
+            else:
+                log_path = os.path.join(log_dir, f'{os.path.splitext(name)[0]}.log')
+                logging.error('Prediction for %s on GPU %s failed; last lines of %s:\n%s',
+                              name, gpu_id, log_path, _log_tail(log_path))
+                failed.append(name)
+    return failed
+
+
+def _sanitised_name(host_json_path: str) -> Optional[str]:
+    """Return the job name run_alphafold.py uses for an input JSON's output directory.
+
+    Returns:
+        The sanitised "name" field, or None (with an error logged) if it cannot
+        be read.
+    """
+    try:
+        with open(host_json_path) as f:
+            name = json.load(f)['name']
+        if not isinstance(name, str):
+            raise TypeError(f'"name" is not a string: {name!r}')
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.error('Could not read the job name from %s: %s', host_json_path, e)
+        return None
+    # Same sanitisation as alphafold3's folding_input.Input.sanitised_name().
+    allowed_chars = set(string.ascii_lowercase + string.digits + '_-.')
+    return ''.join(c for c in name.lower().replace(' ', '_') if c in allowed_chars)
+
+
+def _check_split_outputs(jobs: List[Tuple[str, str, str]], host_output_dir: str) -> None:
+    """Refuse split mode for inputs it cannot run, or where inference would overwrite earlier results.
+
+    Each input must be a single AlphaFold 3 job with a "name": the stages are
+    joined through that job's one <name>_data.json, so AlphaFold Server
+    (list) inputs, which may hold several jobs, are not supported.
+
+    Split-mode inference always runs with --force_output_dir=true so it writes
+    into <output_dir>/<name>/ next to the data pipeline output. If that
+    directory is already non-empty, the data pipeline writes to a timestamped
+    <name>_<timestamp>/ instead, and inference would clobber the old <name>/.
+    The same happens when two inputs share a name.
+
+    Args:
+        jobs: (JSON file name, host path, container path) for each input.
+        host_output_dir: The output directory on the host.
+
+    Raises:
+        app.UsageError: If an input is not a single named job, or a job's output
+            directory is taken (unless --force_output_dir is set).
+    """
+    unnamed = [name for name, host_json_path, _ in jobs if _sanitised_name(host_json_path) is None]
+    if unnamed:
+        raise app.UsageError('--pipeline_mode=split needs single-job AlphaFold 3 inputs with a "name" '
+                             f'(not AlphaFold Server lists): {", ".join(unnamed)}')
+    if FLAGS.force_output_dir:
+        return
+    seen = set()
+    conflicts = []
+    for name, host_json_path, _ in jobs:
+        sanitised = _sanitised_name(host_json_path)
+        job_dir = os.path.join(host_output_dir, sanitised)
+        if sanitised in seen or (os.path.isdir(job_dir) and os.listdir(job_dir)):
+            conflicts.append(f'{name} ({job_dir})')
+        seen.add(sanitised)
+    if conflicts:
+        raise app.UsageError(
+            '--pipeline_mode=split needs an empty output directory per job name, or '
+            f'--force_output_dir to overwrite it: {", ".join(conflicts)}')
+
+
+def _find_data_json(host_output_dir: str, host_json_path: str) -> Optional[str]:
+    """Locate the <name>_data.json written by the data pipeline for an input JSON.
+
+    run_alphafold.py writes it to <output_dir>/<name>/ (or a timestamped
+    <name>_<timestamp>/ if that directory was not empty), where <name> is the
+    sanitised "name" field of the input.
+
+    Returns:
+        The newest matching host path, or None if there is none.
+    """
+    sanitised = _sanitised_name(host_json_path)
+    if sanitised is None:
+        return None
+    candidates = glob.glob(os.path.join(glob.escape(host_output_dir), glob.escape(sanitised) + '*',
+                                        glob.escape(sanitised) + '_data.json'))
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def _run_split(jobs: List[Tuple[str, str, str]], full_command: List[str], bind_arg: Optional[str],
+               host_output_dir: str, container_output_dir: str, log_dir: str,
+               instance_uri: Optional[str] = None, container_env: Tuple[str, ...] = (),
+               host_pipeline: Optional[Tuple[List[str], Dict[str, str]]] = None) -> List[str]:
+    """Run the data pipeline and inference as separate, overlapping containers.
+
+    Data pipeline containers (CPU only) run in a pool sized so that the
+    concurrent searches fit the host's CPUs. As soon as a job's data pipeline
+    finishes, its <name>_data.json is queued for inference on the GPU pool, so
+    the GPUs work on finished jobs while later jobs are still being searched.
+
+    Args:
+        jobs: (JSON file name, host path, container path) for each input.
+        full_command: The run_alphafold.py command line, without input or stage arguments.
+        bind_arg: The comma-separated Singularity bind list, see _run_stage.
+        host_output_dir: The output directory on the host.
+        container_output_dir: The output directory inside the container.
+        log_dir: Host directory for the per-job, per-stage logs.
+        instance_uri: Optional persistent instance to exec into, see _run_stage.
+        container_env: Extra container environment variables, see _run_stage.
+        host_pipeline: Optional host data pipeline, see _run_stage.
+
+    Returns:
+        The names of the JSON files for which either stage failed.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    gpu_ids = _resolve_gpu_ids(FLAGS.gpu_devices) if FLAGS.use_gpu else ['all']
+    n_data_workers = _split_data_workers(len(jobs), FLAGS.jackhmmer_n_cpu)
+    logging.info('Running %d jobs in split mode: %d data pipeline workers, GPUs %s (per-job logs in %s)',
+                 len(jobs), n_data_workers, ','.join(gpu_ids), log_dir)
+    # Inference writes into <name>/ next to the data pipeline output of the same
+    # job; _check_split_outputs made sure that is where the data JSON lands.
+    inference_command = ['--force_output_dir=true' if arg.startswith('--force_output_dir=') else arg
+                         for arg in full_command]
+
+    failed = []
+    # With --cpu_set=auto, data and inference workers get disjoint CPU slices
+    cpu_slices = _cpu_slices(n_data_workers + len(gpu_ids))
+    data_slices, gpu_slices = (cpu_slices[:n_data_workers], cpu_slices[n_data_workers:]) if cpu_slices else (None, None)
+    with _worker_pool(n_data_workers, cpu_slices=data_slices) as data_pool, \
+            _worker_pool(len(gpu_ids), gpu_ids, gpu_slices) as gpu_pool:
+        data_futures = {}
+        for name, host_json_path, container_json_path in jobs:
+            stem = os.path.splitext(name)[0]
+            future = data_pool.submit(_run_stage, _PIPELINE_STAGES['data'],
+                                      [f'--json_path={container_json_path}'], full_command, bind_arg,
+                                      False, FLAGS.gpu_devices, os.path.join(log_dir, f'{stem}.data.log'),
+                                      instance_uri, FLAGS.numa_node, container_env, host_pipeline)
+            data_futures[future] = (name, host_json_path)
+
+        inference_futures = []
+        for future in concurrent.futures.as_completed(data_futures):
+            name, host_json_path = data_futures[future]
+            data_json = _find_data_json(host_output_dir, host_json_path) if future.result() else None
+            if data_json is None:
+                log_path = os.path.join(log_dir, f'{os.path.splitext(name)[0]}.data.log')
+                logging.error('Data pipeline for %s failed; last lines of %s:\n%s',
+                              name, log_path, _log_tail(log_path))
+                failed.append(name)
+                continue
+            logging.info('Data pipeline for %s finished; queueing inference', name)
+            container_data_json = container_output_dir + '/' + os.path.relpath(data_json, host_output_dir)
+            inference_futures.append(gpu_pool.submit(
+                _run_one, name, container_data_json, _PIPELINE_STAGES['inference'], inference_command,
+                bind_arg, FLAGS.use_gpu, os.path.join(log_dir, f'{os.path.splitext(name)[0]}.inference.log'),
+                instance_uri, FLAGS.numa_node, container_env))
+
+        for future in concurrent.futures.as_completed(inference_futures):
+            name, gpu_id, ok = future.result()
+            if ok:
+                logging.info('Finished %s on GPU %s', name, gpu_id)
+            else:
+                log_path = os.path.join(log_dir, f'{os.path.splitext(name)[0]}.inference.log')
+                logging.error('Inference for %s on GPU %s failed; last lines of %s:\n%s',
+                              name, gpu_id, log_path, _log_tail(log_path))
+                failed.append(name)
+    return failed
+
+
+def _msa_search_config() -> str:
+    """Describe the settings the MSAs and templates of a sequence depend on.
+
+    Part of the cache key (see _msa_cache_paths), so a run with another
+    --max_template_date or other databases does not reuse their entries.
+    """
+    return '\0'.join([FLAGS.max_template_date] + sorted(normalize_path(db_dir) for db_dir in FLAGS.db_dir))
+
+
+def _msa_cache_paths(cache_dir: str, sequence: str, search_config: str) -> Tuple[str, str, str]:
+    """Return the (unpaired MSA, paired MSA, templates) cache files for a protein sequence.
+
+    search_config is the value of _msa_search_config() for this launch.
+    """
+    key = hashlib.sha256(f'{search_config}\0{sequence}'.encode()).hexdigest()
+    prefix = os.path.join(cache_dir, key)
+    return (f'{prefix}.a3m', f'{prefix}.paired.a3m', f'{prefix}.templates.json')
+
+
+def _protein_chains(fold_input) -> List[dict]:
+    """Return the 'protein' entries of an AlphaFold 3 input (or _data.json) object."""
+    if not isinstance(fold_input, dict):
+        return []
+    return [entry['protein'] for entry in fold_input.get('sequences') or []
+            if isinstance(entry, dict) and isinstance(entry.get('protein'), dict)
+            and isinstance(entry['protein'].get('sequence'), str)]
+
+
+def _hydrate_msa_cache(json_path: str, cache_dir: str, staging_dir: str, search_config: str) -> str:
+    """Copy an input JSON into staging_dir, filling in cached MSAs for its protein chains.
+
+    Protein chains that do not already specify an MSA and whose sequence is in
+    the cache get their unpairedMsa/pairedMsa (and templates, if cached) set,
+    so the data pipeline skips the genetic search for them.
+
+    Args:
+        json_path: The input JSON on the host.
+        cache_dir: The --msa_cache_dir directory.
+        staging_dir: Host directory (under the bound tmp dir) for the patched copy.
+        search_config: Part of the cache key, see _msa_search_config.
+
+    Returns:
+        The path of the copy in staging_dir.
+    """
+    staged_path = os.path.join(staging_dir, os.path.basename(json_path))
+    with open(json_path) as f:
+        fold_input = json.load(f)
+
+    hydrated = 0
+    for chain in _protein_chains(fold_input):
+        if chain.get('unpairedMsa') is not None or chain.get('pairedMsa') is not None:
+            continue
+        unpaired_path, paired_path, templates_path = _msa_cache_paths(cache_dir, chain['sequence'],
+                                                                      search_config)
+        try:
+            with open(unpaired_path) as f:
+                unpaired_msa = f.read()
+            with open(paired_path) as f:
+                paired_msa = f.read()
+        except FileNotFoundError:
+            continue
+        chain['unpairedMsa'] = unpaired_msa
+        chain['pairedMsa'] = paired_msa
+        if chain.get('templates') is None and os.path.exists(templates_path):
+            with open(templates_path) as f:
+                chain['templates'] = json.load(f)
+        hydrated += 1
+
+    with open(staged_path, 'w') as f:
+        json.dump(fold_input, f)
+    if hydrated:
+        logging.info('Using cached MSAs for %d protein chain(s) of %s', hydrated, json_path)
+    return staged_path
+
+
+def _write_cache_file(path: str, text: str) -> None:
+    """Write a cache entry atomically, so concurrent launches never see partial files."""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _store_msa_cache(staged_jsons: List[str], host_output_dir: str, cache_dir: str,
+                     search_config: str, since: float) -> None:
+    """Add the MSAs computed by this launch to the cache.
+
+    Reads the <name>_data.json this launch wrote for each staged input and stores the
+    MSAs of every protein chain that the data pipeline searched (no MSA in the
+    staged input) and whose sequence is not cached yet. MSAs supplied by the
+    user, including the empty ones of MSA-free runs, are never cached, and
+    templates only when the pipeline searched for them too.
+
+    Args:
+        staged_jsons: The staged input JSONs (see _hydrate_msa_cache) of the
+            jobs that succeeded.
+        host_output_dir: The output directory on the host.
+        cache_dir: The --msa_cache_dir directory.
+        search_config: Part of the cache key, see _msa_search_config.
+        since: Start time of the launch. Older <name>_data.json files are left
+            over from earlier runs (possibly with other or user-supplied MSAs)
+            and are ignored.
+    """
+    for staged_path in staged_jsons:
+        data_json = _find_data_json(host_output_dir, staged_path)
+        if data_json is None or os.path.getmtime(data_json) < since:
+            continue
+        try:
+            with open(staged_path) as f:
+                staged_chains = _protein_chains(json.load(f))
+            with open(data_json) as f:
+                fold_input = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning('Could not read %s for the MSA cache: %s', data_json, e)
+            continue
+        # Chains are matched by id; the data pipeline keeps the input's ids
+        searched = {json.dumps(chain.get('id')): chain.get('templates') is None for chain in staged_chains
+                    if chain.get('unpairedMsa') is None and chain.get('pairedMsa') is None}
+        for chain in _protein_chains(fold_input):
+            chain_id = json.dumps(chain.get('id'))
+            if chain_id not in searched:
+                continue
+            unpaired_path, paired_path, templates_path = _msa_cache_paths(cache_dir, chain['sequence'],
+                                                                          search_config)
+            if os.path.exists(unpaired_path) or chain.get('unpairedMsa') is None:
+                continue
+            if searched[chain_id] and chain.get('templates') is not None:
+                _write_cache_file(templates_path, json.dumps(chain['templates']))
+            _write_cache_file(paired_path, chain.get('pairedMsa') or '')
+            # Written last: its presence marks the entry as complete
+            _write_cache_file(unpaired_path, chain['unpairedMsa'])
+            logging.info('Cached MSAs for a %d-residue chain from %s', len(chain['sequence']), data_json)
+
+
+def _host_data_pipeline(binds: List[str]) -> Optional[Tuple[List[str], Dict[str, str]]]:
+    """Check whether the data pipeline can run on the host, for --no_container_data_pipeline.
+
+    Args:
+        binds: The launch's bind strings, used to map container paths back to
+            the host.
+
+    Returns:
+        The host command prefix (Python and run_alphafold.py) and the mapping
+        from container to host paths, or None (with a warning) if the host
+        lacks alphafold3, jackhmmer or run_alphafold.py.
+    """
+    missing = []
+    if importlib.util.find_spec('alphafold3') is None:
+        missing.append('the alphafold3 Python package')
+    if shutil.which('jackhmmer') is None:
+        missing.append('jackhmmer')
+    if not FLAGS.host_run_alphafold or not os.path.isfile(normalize_path(FLAGS.host_run_alphafold)):
+        missing.append('run_alphafold.py (--host_run_alphafold)')
+    if missing:
+        logging.warning('--no_container_data_pipeline: %s not found on the host; '
+                        'running the data pipeline in the container.', ', '.join(missing))
+        return None
+    host_remap = {}
+    for spec in binds:
+        source, target = spec.split(':', 2)[:2]
+        host_remap[target] = source
+    return [sys.executable, normalize_path(FLAGS.host_run_alphafold)], host_remap
+
+
+def _build_common_binds(host_dirs: List[str]) -> Tuple[Tuple[str, ...], Dict[str, object], List[str]]:
+    """Build the binds that every container of a launch shares.
+
+    These are the output, model, database, tmp and XLA cache directories; the
+    input bind is added by _launch.
+
+    Args:
+        host_dirs: Output/tmp/cache directories to create are appended here,
+            see make_host_dirs.
+
+    Returns:
+        A tuple containing:
+          - The bind strings.
+          - The container paths, keyed 'output', 'models', 'db' (a list, one per
+            --db_dir), 'tmp' and, if the cache is enabled, 'xla_cache'.
+          - Extra 'NAME=value' environment variables for the container.
+    """
+    binds = []
+    container_paths = {}
 
     # Output directory
-    bind_spec, container_output_dir = _create_bind('output', FLAGS.output_dir, is_dir=True)
+    bind_spec, container_paths['output'] = _create_bind('output', FLAGS.output_dir, is_dir=True,
+                                                        pending_dirs=host_dirs)
     binds.append(bind_spec)
-    command_args.append(f'--output_dir={container_output_dir}')
 
     # Model parameters directory
-    bind_spec, container_model_dir = _create_bind('models', FLAGS.model_dir, is_dir=True)
+    bind_spec, container_paths['models'] = _create_bind('models', FLAGS.model_dir, is_dir=True)
     binds.append(bind_spec)
-    command_args.append(f'--model_dir={container_model_dir}')
 
     # Database directories (potentially multiple)
-    container_db_dirs = []
+    container_paths['db'] = []
     for i, db_path in enumerate(FLAGS.db_dir):
         bind_spec, container_db_path = _create_bind(f'db_{i}', db_path, is_dir=True)
         binds.append(bind_spec)
-        container_db_dirs.append(container_db_path)
-        command_args.append(f'--db_dir={container_db_path}') # Pass each one
+        container_paths['db'].append(container_db_path)
 
     # Temporary directory
-    bind_spec, container_tmp_dir = _create_bind('tmp', tmp_dir, is_dir=True)
+    bind_spec, container_paths['tmp'] = _create_bind('tmp', tmp_dir, is_dir=True, pending_dirs=host_dirs)
     binds.append(bind_spec)
     # Singularity typically inherits TMPDIR, but binding explicitly can be safer
 
+    # Persistent JAX compilation cache, so later runs skip recompiling the model
+    container_env = []
+    if FLAGS.xla_cache_dir:
+        bind_spec, container_paths['xla_cache'] = _create_bind('xla_cache', FLAGS.xla_cache_dir, is_dir=True,
+                                                               pending_dirs=host_dirs)
+        binds.append(bind_spec)
+        container_env.append(f"JAX_COMPILATION_CACHE_DIR={container_paths['xla_cache']}")
+    if FLAGS.xla_mem_fraction is not None:
+        container_env.append(f'XLA_PYTHON_CLIENT_MEM_FRACTION={FLAGS.xla_mem_fraction}')
+
+    return tuple(binds), container_paths, container_env
+
+
+def _launch(input_dir: Optional[str], json_path: Optional[str], json_names: List[str]) -> List[str]:
+    """Bind the inputs, build the run_alphafold.py command and run the container(s).
+
+    Args:
+        input_dir: Host directory of input JSONs, or None to use json_path.
+        json_path: Host input JSON, used if input_dir is None.
+        json_names: The names of the .json files in input_dir (see _list_jsons).
+
+    Returns:
+        The names of the input JSON files whose prediction failed (all of them
+        if a single container ran and failed).
+    """
+    # --- Prepare Singularity Bind Mounts ---
+    binds = []
+    host_dirs = [] # Output/tmp directories to create, see make_host_dirs
+    command_args = [] # Arguments for the internal run_alphafold.py
+
+    # Input JSON path or directory
+    container_json_path = None
+    container_input_dir = None
+    input_args = []
+    sharded_jsons = []
+    if input_dir:
+        bind_spec, container_input_dir = _create_bind('input_dir', input_dir, is_dir=True)
+        binds.append(bind_spec)
+        gpu_ids = _resolve_gpu_ids(FLAGS.gpu_devices) if FLAGS.use_gpu else []
+        if len(gpu_ids) > 1 and len(json_names) > 1:
+            # One container per JSON, spread over the GPUs
+            sharded_jsons = json_names
+        else:
+            input_args.append(f'--input_dir={container_input_dir}')
+    elif json_path:
+        bind_spec, container_json_path = _create_bind('json_input', json_path, is_dir=False)
+        binds.append(bind_spec)
+        input_args.append(f'--json_path={container_json_path}')
+
+    # --- Size the MSA tools for the number of concurrent data pipelines ---
+    if FLAGS.pipeline_mode == 'split':
+        n_jobs = len(json_names) if input_dir else 1
+        # As many data pipeline jobs as the host fits, full-width (_MAX_MSA_CPUS)
+        # unless --jackhmmer_n_cpu is given; _run_split sizes its pool the same way
+        concurrent_jobs = _split_data_workers(n_jobs, FLAGS.jackhmmer_n_cpu or _MAX_MSA_CPUS)
+    elif sharded_jsons:
+        concurrent_jobs = min(len(gpu_ids), len(sharded_jsons))
+    else:
+        concurrent_jobs = 1
+    default_msa_cpus = _default_msa_cpus(concurrent_jobs)
+    for name in ('jackhmmer_n_cpu', 'nhmmer_n_cpu'):
+        if FLAGS[name].value is None:
+            FLAGS[name].value = default_msa_cpus
+            logging.info('Using --%s=%d (%d host CPUs, %d reserved, %d concurrent jobs x %d searches)',
+                         name, default_msa_cpus, _host_cpu_count(), _RESERVED_CPUS,
+                         concurrent_jobs, _CONCURRENT_MSA_SEARCHES)
+
+    common_binds, container_paths, container_env = _build_common_binds(host_dirs)
+    binds.extend(common_binds)
+    container_output_dir = container_paths['output']
+    command_args.append(f'--output_dir={container_output_dir}')
+    command_args.append(f"--model_dir={container_paths['models']}")
+    command_args.extend(f'--db_dir={path}' for path in container_paths['db']) # Pass each one
+
+    make_host_dirs(host_dirs)
+
+    # Fold binds that are already covered by another one (e.g. a db_dir given
+    # twice, or an input inside the tmp dir) and point their paths at it.
+    binds, bind_remap = coalesce_binds(binds)
+    # dict.fromkeys drops repeated --db_dir arguments that now name the same path
+    command_args = list(dict.fromkeys(remap_arg(arg, bind_remap) for arg in command_args))
+    input_args = [remap_arg(arg, bind_remap) for arg in input_args]
+    container_input_dir = container_input_dir and remap_arg(container_input_dir, bind_remap)
+    container_json_path = container_json_path and remap_arg(container_json_path, bind_remap)
+    container_output_dir = remap_arg(container_output_dir, bind_remap)
+    container_env = tuple(remap_arg(variable, bind_remap) for variable in container_env)
+    # Joined once here; every job and the instance reuse the same --bind value
+    bind_arg = ','.join(binds)
+
     # --- Construct Command ---
     command_args.extend([
-        f'--run_data_pipeline={str(FLAGS.run_data_pipeline).lower()}',
-        f'--run_inference={str(FLAGS.run_inference).lower()}',
         f'--conformer_max_iterations={FLAGS.conformer_max_iterations}',
         # Pass through newly added flags
         f'--jackhmmer_n_cpu={FLAGS.jackhmmer_n_cpu}',
@@ -269,37 +1226,54 @@ def main(argv):
     # Prepend the python execution command
     run_script_path = '/app/run_alphafold.py' # Assuming this is the path inside the SIF
     full_command = ['python', run_script_path] + command_args
+    log_dir = os.path.join(normalize_path(FLAGS.output_dir), 'logs')
+    host_pipeline = _host_data_pipeline(binds) if FLAGS.no_container_data_pipeline else None
 
-    # --- Prepare Singularity Options ---
-    options = [
-        '--bind', f'{",".join(binds)}',
-        '--env', f'NVIDIA_VISIBLE_DEVICES={FLAGS.gpu_devices}',
-        # Add performance-related env vars if needed (might depend on GPU/setup)
-        # '--env', 'TF_FORCE_UNIFIED_MEMORY=1',
-        # '--env', 'XLA_PYTHON_CLIENT_MEM_FRACTION=4.0', # Adjust as needed
-    ]
+    if FLAGS.pipeline_mode == 'both':
+        stage = (FLAGS.run_data_pipeline, FLAGS.run_inference)
+    elif FLAGS.pipeline_mode != 'split': # split runs both stages, see _run_split
+        stage = _PIPELINE_STAGES[FLAGS.pipeline_mode]
 
-    # --- Execute Singularity Command ---
-    logging.info('Running Singularity command:')
-    logging.info(f'Image: {_ALPHAFOLD3_SIF_PATH}')
-    logging.info(f'Options: {options}')
-    logging.info(f'Command: {" ".join(full_command)}')
+    if FLAGS.pipeline_mode == 'split':
+        if input_dir:
+            jobs = [(name, os.path.join(input_dir, name), f'{container_input_dir}/{name}')
+                    for name in json_names]
+        else:
+            jobs = [(os.path.basename(json_path), json_path, container_json_path)]
+        _check_split_outputs(jobs, normalize_path(FLAGS.output_dir))
 
-    try:
-        # Use Client.execute which streams output, better for long jobs
-        # Client.run returns all output only at the end.
-        result = Client.execute(
-                 singularity_image,
-                 full_command,
-                 nv=FLAGS.use_gpu,
-                 options=options,
-                 stream=True # Stream stdout/stderr
-               )
-        for line in result:
-            print(line, end='') # Print container output in real-time
+    if FLAGS.pipeline_mode == 'split' or sharded_jsons:
+        # Several containers per launch: run them all in one instance if requested
+        persistent_instance = FLAGS.persistent_instance
+        if persistent_instance is None:
+            persistent_instance = bool(input_dir)
+        instance_uri = None
+        if persistent_instance:
+            try:
+                instance_uri = _start_instance(f'alphafold3_{os.getpid()}', bind_arg, FLAGS.use_gpu)
+            except (OSError, subprocess.CalledProcessError) as e:
+                logging.warning('Could not start a Singularity instance (%s); using one container per job.', e)
+        with _instance_running(instance_uri) if instance_uri else contextlib.nullcontext():
+            if FLAGS.pipeline_mode == 'split':
+                failed = _run_split(jobs, full_command, bind_arg, normalize_path(FLAGS.output_dir),
+                                    container_output_dir, log_dir, instance_uri, container_env,
+                                    host_pipeline)
+            else:
+                jobs = sharded_jsons
+                logging.info('Running %d JSON files from %s on GPUs %s (per-job logs in %s)',
+                             len(sharded_jsons), input_dir, ','.join(gpu_ids), log_dir)
+                failed = _run_sharded(sharded_jsons, container_input_dir, stage, full_command, bind_arg,
+                                      gpu_ids, log_dir, instance_uri, container_env, host_pipeline)
+        if failed:
+            logging.error('%d of %d predictions failed: %s', len(failed), len(jobs), ', '.join(sorted(failed)))
+        else:
+            logging.info('AlphaFold 3 prediction finished.')
+        return failed
 
-    except Exception as e:
-        logging.error(f"Error executing Singularity command: {e}")
+    # --- Execute Singularity Command ---
+    if not _run_stage(stage, input_args, full_command, bind_arg, FLAGS.use_gpu, FLAGS.gpu_devices,
+                      numa_node=FLAGS.numa_node, container_env=container_env,
+                      host_pipeline=host_pipeline):
         # Attempt to clean up default output dir if it was created and is empty
         try:
             if FLAGS.output_dir == output_dir_default and os.path.exists(output_dir_default) and not os.listdir(output_dir_default):
@@ -307,9 +1281,126 @@ def main(argv):
                 os.rmdir(output_dir_default)
         except OSError as rm_err:
             logging.warning(f"Could not remove default output directory: {rm_err}")
-        sys.exit(1)
+        return [os.path.basename(json_path)] if json_path else json_names
 
     logging.info('AlphaFold 3 prediction finished.')
+    return []
+
+
+
+def main(argv):
+    if len(argv) > 1:
+        raise app.UsageError('Too many command-line arguments.')
+
+    if not FLAGS.json_path and not FLAGS.input_dir:
+        raise app.UsageError('Either --json_path or --input_dir must be specified.')
+    if FLAGS.json_path and FLAGS.input_dir:
+        logging.warning('--input_dir specified, ignoring --json_path.')
+    if not FLAGS.model_dir:
+        raise app.UsageError('--model_dir must be specified.')
+    if not FLAGS.db_dir:
+        raise app.UsageError('--db_dir must be specified (can be provided multiple times).')
+    if FLAGS.no_container_data_pipeline and (
+            FLAGS.pipeline_mode == 'inference'
+            or (FLAGS.pipeline_mode == 'both' and (FLAGS.run_inference or not FLAGS.run_data_pipeline))):
+        raise app.UsageError('--no_container_data_pipeline needs a data-pipeline-only stage: use '
+                             '--pipeline_mode=split or --pipeline_mode=data (or --norun_inference).')
+
+    try:
+        load_image(_ALPHAFOLD3_SIF_PATH) # Validate the image before preparing the run
+    except FileNotFoundError: # load_image stats the file first
+        print(f"Error: Singularity image not found at '{_ALPHAFOLD3_SIF_PATH}'.")
+        print("Please set the ALPHAFOLD3_SIF environment variable or update the _ALPHAFOLD3_SIF_PATH in this script.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error loading Singularity image '{_ALPHAFOLD3_SIF_PATH}': {e}")
+        sys.exit(1)
+
+    logging.info('Using Singularity image: %s', _ALPHAFOLD3_SIF_PATH)
+    logging.info('Host temporary directory: %s', tmp_dir)
+    logging.info('Default base output directory: %s', output_dir_default)
+
+    # --- CPU and NUMA placement, inherited by every container we start ---
+    if FLAGS.numa_node is not None and not shutil.which('numactl'):
+        raise app.UsageError('--numa_node requires numactl on the PATH.')
+    if FLAGS.numa_node is not None or FLAGS.cpu_set not in (None, 'auto'):
+        cpus = os.sched_getaffinity(0)
+        try:
+            if FLAGS.numa_node is not None:
+                cpus &= _numa_node_cpus(FLAGS.numa_node)
+            if FLAGS.cpu_set not in (None, 'auto'):
+                cpus &= _parse_cpu_list(FLAGS.cpu_set)
+        except (OSError, ValueError) as e:
+            raise app.UsageError(f'Invalid --numa_node/--cpu_set: {e}')
+        if not cpus:
+            raise app.UsageError('--numa_node/--cpu_set leave no CPUs available to the launcher.')
+        os.sched_setaffinity(0, cpus)
+        logging.info('Running containers on CPUs %s', ','.join(map(str, sorted(cpus))))
+
+    if FLAGS.use_gpu and FLAGS['flash_attention_implementation'].using_default_value:
+        FLAGS.flash_attention_implementation = _autodetect_flash_impl(FLAGS.gpu_devices)
+
+    # --- Start reading the databases while the containers are brought up ---
+    if FLAGS.prewarm_db:
+        if hasattr(os, 'posix_fadvise'):
+            db_files = _database_files([normalize_path(db_dir) for db_dir in FLAGS.db_dir])
+            threading.Thread(target=_prewarm, args=(db_files,), name='prewarm_db', daemon=True).start()
+        else:
+            logging.warning('--prewarm_db is not supported on this platform (no posix_fadvise).')
+
+    # --- Enumerate and check the inputs before starting any container ---
+    if FLAGS.input_dir:
+        json_names = _list_jsons(normalize_path(FLAGS.input_dir))
+        if not json_names:
+            logging.error('No .json files found in %s', FLAGS.input_dir)
+            sys.exit(1)
+        sources = [os.path.join(normalize_path(FLAGS.input_dir), name) for name in json_names]
+    else:
+        json_names = []
+        sources = [normalize_path(path) for path in FLAGS.json_path]
+    invalid = [(source, _check_input_json(source)) for source in sources]
+    invalid = [(source, error) for source, error in invalid if error]
+    for source, error in invalid:
+        logging.error('Invalid input JSON %s: %s', source, error)
+    if invalid:
+        sys.exit(1)
+
+    # Several --json_path files are run as one input directory
+    input_dir = FLAGS.input_dir and normalize_path(FLAGS.input_dir)
+    link_dir = None
+    if not input_dir and len(sources) > 1:
+        link_dir = input_dir = _link_inputs(sources)
+        json_names = sorted(os.path.basename(source) for source in sources)
+    try:
+        if not FLAGS.msa_cache_dir:
+            if _launch(input_dir, None if input_dir else sources[0], json_names):
+                sys.exit(1)
+            return
+
+        # --- Stage the inputs with cached MSAs filled in ---
+        cache_dir = normalize_path(FLAGS.msa_cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        os.makedirs(normalize_path(tmp_dir), exist_ok=True) # Before _create_bind would create it
+        staging_dir = tempfile.mkdtemp(prefix='alphafold3_msa_', dir=normalize_path(tmp_dir))
+        search_config = _msa_search_config()
+        staged_jsons = [_hydrate_msa_cache(source, cache_dir, staging_dir, search_config) for source in sources]
+        # Whole seconds, as some file systems store coarse modification times
+        launch_start = int(time.time())
+        try:
+            if input_dir:
+                failed = _launch(staging_dir, None, json_names)
+            else:
+                failed = _launch(None, staged_jsons[0], json_names)
+            # Only from jobs that succeeded, never after the launch itself failed
+            _store_msa_cache([path for path in staged_jsons if os.path.basename(path) not in failed],
+                             normalize_path(FLAGS.output_dir), cache_dir, search_config, launch_start)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        if failed:
+            sys.exit(1)
+    finally:
+        if link_dir:
+            shutil.rmtree(link_dir, ignore_errors=True)
 
 
 if __name__ == '__main__':
@@ -1,23 +1,19 @@
 """Singularity launch script for Boltz Singularity image."""
 
+import json
 import os
 import sys
-import pathlib
-import signal
-from typing import List, Tuple, Optional
-import multiprocessing
-import datetime
-import tempfile
+import socket
+from typing import Dict, List, Tuple, Optional
 
 from absl import app
 from absl import flags
 from absl import logging
 
-try:
-    from spython.main import Client
-except ImportError:
-    print("Error: spython library not found. Please install it: pip install spython")
-    sys.exit(1)
+# Helpers shared by all launchers live in <repo>/common.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from launcher_utils import (canonical_paths, coalesce_binds, create_bind, load_image, make_host_dirs,
+                            non_default_args, normalize_path, probe, remap_arg, run_command)
 
 #### USER CONFIGURATION ####
 
@@ -50,118 +46,110 @@ output_dir_default = os.path.join(os.getcwd(), 'boltz_output')
 _ROOT_MOUNT_DIRECTORY = '/mnt_launcher/' # Using a more unique root to avoid clashes
 FLAGS = flags.FLAGS
 
-def _create_bind(mount_point_name: str, host_path: str, is_dir: bool = True, read_only: bool = False) -> Tuple[str, str]:
-    """Create a bind mount specification for Singularity.
-
-    Args:
-        mount_point_name: A descriptive name for the mount point (used for target path).
-        host_path: The absolute path on the host system.
-        is_dir: Whether the host_path is a directory.
-        read_only: Whether to mount as read-only (appends ':ro').
-
-    Returns:
-        A tuple containing:
-          - The bind string for Singularity ('host_path:target_path[:ro]').
-          - The corresponding path inside the container.
+# Container path of every mount point the launcher binds.
+_MOUNT_TARGETS = {name: _ROOT_MOUNT_DIRECTORY + name
+                  for name in ('input_data', 'output', 'boltz_cache', 'checkpoint_file', 'tmp')}
+
+# Boltz options forwarded only when they differ from the Boltz default.
+# Each entry is (launcher flag name, Boltz default, CLI template).
+_BOLTZ_VALUE_FLAGS = (
+    ('devices', 1, '--devices={}'),
+    ('accelerator', 'gpu', '--accelerator={}'),
+    ('recycling_steps', 3, '--recycling_steps={}'),
+    ('sampling_steps', 200, '--sampling_steps={}'),
+    ('diffusion_samples', 1, '--diffusion_samples={}'),
+    ('step_scale', 1.638, '--step_scale={}'),
+    ('output_format', 'mmcif', '--output_format={}'),
+    ('num_workers', 2, '--num_workers={}'),
+    ('seed', None, '--seed={}'),
+)
+
+# Only relevant when --use_msa_server is set.
+_BOLTZ_MSA_SERVER_FLAGS = (
+    ('msa_server_url', 'https://api.colabfold.com', '--msa_server_url={}'),
+    ('msa_pairing_strategy', 'greedy', '--msa_pairing_strategy={}'),
+)
+
+# Flags a server-mode job may not override.
+_SERVER_FIXED_FLAGS = frozenset({'sif_path', 'server_mode'})
+
+
+def _create_bind(mount_point_name: str, host_path: str, is_dir: bool = True, read_only: bool = False,
+                 pending_dirs: Optional[List[str]] = None) -> Tuple[str, str]:
+    """Create a Boltz bind mount under _ROOT_MOUNT_DIRECTORY (see launcher_utils.create_bind).
+
+    Output, tmp and Boltz cache directories are created on the host if missing;
+    every other host path must already exist.
     """
-    host_path = os.path.abspath(os.path.expanduser(host_path))
-    target_base = os.path.join(_ROOT_MOUNT_DIRECTORY, mount_point_name)
-
-    if is_dir:
-        source_path = host_path
-        target_path_container = target_base
-    else: # it's a file
-        source_path = os.path.dirname(host_path)
-        target_path_container = os.path.join(target_base, os.path.basename(host_path))
-        # We bind the directory containing the file, and adjust container path
-        # So, the actual mount target for singularity is target_base
-
-    # Create target directory on host if it doesn't exist for output/tmp/cache
-    if mount_point_name.startswith('output') or mount_point_name == 'tmp' or mount_point_name == 'boltz_cache':
-       os.makedirs(host_path, exist_ok=True) # source_path is host_path for dirs
-    elif not os.path.exists(source_path): # For other inputs like data or checkpoint file's dir
-        logging.error(f"Host path for binding does not exist: {source_path} (for mount {mount_point_name})")
-        sys.exit(1)
-    
-    # For file binds, the actual target in singularity is the directory.
-    # The container_path variable correctly reflects the file path within that mounted dir.
-    actual_bind_target = target_base 
+    create = mount_point_name.startswith('output') or mount_point_name in ('tmp', 'boltz_cache')
+    return create_bind(_MOUNT_TARGETS[mount_point_name], mount_point_name, host_path, is_dir=is_dir,
+                       read_only=read_only, create=create, pending_dirs=pending_dirs)
 
-    bind_spec = f'{source_path}:{actual_bind_target}'
-    if read_only:
-        bind_spec += ':ro'
-    
-    logging.info('Binding %s -> %s (container path for item: %s, read_only: %s)',
-                 source_path, actual_bind_target, target_path_container, read_only)
-    return (bind_spec, target_path_container)
 
+def _build_boltz_command(sif_path: str) -> List[str]:
+    """Build the full singularity exec command line for the current flag values.
 
-def main(argv):
-    if len(argv) > 1:
-        raise app.UsageError('Too many command-line arguments.')
+    Args:
+        sif_path: Path to the Boltz Singularity image.
 
-    sif_path = FLAGS.sif_path if FLAGS.sif_path else _BOLTZ_SIF_PATH
-    if not os.path.exists(sif_path):
-        print(f"Error: Singularity image not found at '{sif_path}'.")
-        print("Please set BOLTZ_SIF, update _BOLTZ_SIF_PATH, or use --sif_path.")
-        sys.exit(1)
-    
-    try:
-        singularity_image = Client.load(sif_path)
-    except Exception as e:
-        print(f"Error loading Singularity image '{sif_path}': {e}")
-        sys.exit(1)
+    Returns:
+        The argv list that runs Boltz in the container.
+    """
+    probe.cache_clear() # Paths may have changed since the previous server-mode job
 
-    logging.info(f'INFO: Using Singularity image: {sif_path}')
-    logging.info(f'INFO: Host temporary directory: {tmp_dir_host}')
-    logging.info(f'INFO: Default base output directory: {output_dir_default}')
-    logging.info(f'INFO: Default Boltz cache directory: {_BOLTZ_CACHE_DEFAULT}')
+    # Read every flag once; plain dict lookups are cheaper than FLAGS attributes.
+    flag_values = FLAGS.flag_values_dict()
 
     # --- Argument validation ---
-    if not FLAGS.input_data:
+    if not flag_values['input_data']:
         raise app.UsageError('Missing required argument: --input_data')
 
+    # Normalize every host path once; the bind helpers take them as is.
+    paths = canonical_paths(flag_values, ('input_data', 'out_dir', 'boltz_cache_dir', 'checkpoint'))
+    paths['tmp'] = normalize_path(tmp_dir_host)
+
     # --- Prepare Singularity Bind Mounts ---
     binds = []
+    host_dirs = [] # Created together once all binds are known
     boltz_args = []
 
     # Input Data (corresponds to DATA positional arg for boltz predict)
     # This can be a file or directory according to boltz help
-    is_input_data_dir = os.path.isdir(FLAGS.input_data)
+    _, is_input_data_dir, _ = probe(paths['input_data'])
     bind_spec, container_input_data = _create_bind(
-        'input_data', FLAGS.input_data, is_dir=is_input_data_dir, read_only=True
+        'input_data', paths['input_data'], is_dir=is_input_data_dir, read_only=True
     )
     binds.append(bind_spec)
     # boltz_args will have this as the first positional argument after 'predict'
 
     # Output Directory (--out_dir for boltz)
-    actual_output_dir = FLAGS.out_dir
+    actual_output_dir = paths['out_dir']
     # Handle timestamped subdirectory for output if dir exists and is not empty
     # (Similar logic to other launchers can be added here if desired, but Boltz has --override)
-    os.makedirs(actual_output_dir, exist_ok=True)
-    bind_spec, container_output_dir = _create_bind('output', actual_output_dir, is_dir=True)
+    bind_spec, container_output_dir = _create_bind('output', actual_output_dir, is_dir=True, pending_dirs=host_dirs)
     binds.append(bind_spec)
     boltz_args.append(f'--out_dir={container_output_dir}')
 
     # Boltz Cache Directory (--cache for boltz)
-    actual_boltz_cache_dir = FLAGS.boltz_cache_dir
-    os.makedirs(actual_boltz_cache_dir, exist_ok=True)
-    bind_spec, container_boltz_cache = _create_bind('boltz_cache', actual_boltz_cache_dir, is_dir=True)
+    actual_boltz_cache_dir = paths['boltz_cache_dir']
+    bind_spec, container_boltz_cache = _create_bind('boltz_cache', actual_boltz_cache_dir, is_dir=True, pending_dirs=host_dirs)
     binds.append(bind_spec)
     boltz_args.append(f'--cache={container_boltz_cache}')
 
     # Checkpoint File (optional, --checkpoint for boltz)
-    if FLAGS.checkpoint:
-        if not os.path.isfile(FLAGS.checkpoint):
-            logging.error(f"Checkpoint file not found: {FLAGS.checkpoint}")
+    if flag_values['checkpoint']:
+        if not probe(paths['checkpoint'])[2]:
+            logging.error('Checkpoint file not found: %s', flag_values['checkpoint'])
             sys.exit(1)
-        bind_spec, container_checkpoint = _create_bind('checkpoint_file', FLAGS.checkpoint, is_dir=False, read_only=True)
+        bind_spec, container_checkpoint = _create_bind('checkpoint_file', paths['checkpoint'], is_dir=False, read_only=True)
         binds.append(bind_spec)
         boltz_args.append(f'--checkpoint={container_checkpoint}')
 
     # Temporary directory for Singularity itself
-    bind_spec, container_tmp_dir = _create_bind('tmp', tmp_dir_host, is_dir=True)
+    bind_spec, container_tmp_dir = _create_bind('tmp', paths['tmp'], is_dir=True, pending_dirs=host_dirs)
     binds.append(bind_spec)
+
+    make_host_dirs(host_dirs)
     
     # --- Construct Boltz Command ---
     # Base command: boltz predict <DATA_container_path>
@@ -169,43 +157,28 @@ def main(argv):
 
     # Add other optional flags based on their values
     # For flags with distinct --foo / --no-foo behavior:
-    boltz_args.append('--write_full_pae' if FLAGS.write_full_pae else '--no-write-full-pae')
-    boltz_args.append('--write_full_pde' if FLAGS.write_full_pde else '--no-write-full-pde')
-    boltz_args.append('--override' if FLAGS.override else '--no-override')
-    boltz_args.append('--use_msa_server' if FLAGS.use_msa_server else '--no-use-msa-server')
-    boltz_args.append('--potentials' if FLAGS.enable_potentials else '--no_potentials') # as per investigation
-
-    if FLAGS.devices != 1:
-        boltz_args.append(f'--devices={FLAGS.devices}')
-    if FLAGS.accelerator != 'gpu':
-        boltz_args.append(f'--accelerator={FLAGS.accelerator}')
-    if FLAGS.recycling_steps != 3:
-        boltz_args.append(f'--recycling_steps={FLAGS.recycling_steps}')
-    if FLAGS.sampling_steps != 200:
-        boltz_args.append(f'--sampling_steps={FLAGS.sampling_steps}')
-    if FLAGS.diffusion_samples != 1:
-        boltz_args.append(f'--diffusion_samples={FLAGS.diffusion_samples}')
-    if abs(FLAGS.step_scale - 1.638) > 1e-6: # Comparing floats
-        boltz_args.append(f'--step_scale={FLAGS.step_scale}')
-    if FLAGS.output_format != 'mmcif':
-        boltz_args.append(f'--output_format={FLAGS.output_format}')
-    if FLAGS.num_workers != 2:
-        boltz_args.append(f'--num_workers={FLAGS.num_workers}')
-    if FLAGS.seed is not None:
-        boltz_args.append(f'--seed={FLAGS.seed}')
-    
-    if FLAGS.use_msa_server: # These are only relevant if use_msa_server is true
-        if FLAGS.msa_server_url != "https://api.colabfold.com":
-            boltz_args.append(f'--msa_server_url={FLAGS.msa_server_url}')
-        if FLAGS.msa_pairing_strategy != "greedy":
-            boltz_args.append(f'--msa_pairing_strategy={FLAGS.msa_pairing_strategy}')
+    boltz_args.append('--write_full_pae' if flag_values['write_full_pae'] else '--no-write-full-pae')
+    boltz_args.append('--write_full_pde' if flag_values['write_full_pde'] else '--no-write-full-pde')
+    boltz_args.append('--override' if flag_values['override'] else '--no-override')
+    boltz_args.append('--use_msa_server' if flag_values['use_msa_server'] else '--no-use-msa-server')
+    boltz_args.append('--potentials' if flag_values['enable_potentials'] else '--no_potentials') # as per investigation
+
+    boltz_args.extend(non_default_args(_BOLTZ_VALUE_FLAGS, flag_values))
+    if flag_values['use_msa_server']: # These are only relevant if use_msa_server is true
+        boltz_args.extend(non_default_args(_BOLTZ_MSA_SERVER_FLAGS, flag_values))
 
     full_boltz_command = boltz_exec_command + boltz_args
 
+    # Reuse an existing mount for binds nested inside it (e.g. inputs in one dir)
+    binds, bind_remap = coalesce_binds(binds)
+    full_boltz_command = [remap_arg(arg, bind_remap) for arg in full_boltz_command]
+    container_boltz_cache = remap_arg(container_boltz_cache, bind_remap)
+    container_tmp_dir = remap_arg(container_tmp_dir, bind_remap)
+
     # --- Prepare Singularity Options ---
     singularity_options = [
-        '--bind', f'{",".join(binds)}',
-        '--env', f'NVIDIA_VISIBLE_DEVICES={FLAGS.gpu_devices}',
+        '--bind', ','.join(binds),
+        '--env', f'NVIDIA_VISIBLE_DEVICES={flag_values["gpu_devices"]}',
         # Pass BOLTZ_CACHE to container env, pointing to the mounted cache
         '--env', f'BOLTZ_CACHE={container_boltz_cache}',
     ]
@@ -213,25 +186,121 @@ def main(argv):
         singularity_options.extend(['--env', f'TMPDIR={container_tmp_dir}'])
 
     # --- Execute Singularity Command ---
-    logging.info('Running Singularity command:')
-    logging.info(f'Image: {sif_path}')
-    logging.info(f'Singularity Options: {singularity_options}')
-    logging.info(f'Boltz Command: {" ".join(full_boltz_command)}')
+    if logging.level_info(): # Skip formatting the long command lines when not logged
+        logging.info('Running Singularity command:')
+        logging.info('Image: %s', sif_path)
+        logging.info('Singularity Options: %s', singularity_options)
+        logging.info('Boltz Command: %s', ' '.join(full_boltz_command))
+
+    singularity_command = ['singularity', 'exec']
+    if flag_values['use_gpu']:
+        singularity_command.append('--nv')
+    singularity_command += singularity_options + [sif_path] + full_boltz_command
 
+    return singularity_command
+
+
+def _run_job(request: bytes, baseline: Dict[str, object], sif_path: str) -> Dict[str, object]:
+    """Run one server-mode job and return the JSON-serializable reply.
+
+    Args:
+        request: JSON object mapping launcher flag names to values for this job.
+        baseline: Flag values from the server command line; every job starts
+            from these.
+        sif_path: Path to the Boltz Singularity image.
+
+    Returns:
+        {'returncode': <exit status>} if Boltz ran, otherwise {'error': <message>}.
+    """
     try:
-        result = Client.execute(
-                 singularity_image,
-                 full_boltz_command,
-                 nv=FLAGS.use_gpu,
-                 options=singularity_options,
-                 stream=True # Stream stdout/stderr
-               )
-        for line in result:
-            print(line, end='')
+        job = json.loads(request)
+        if not isinstance(job, dict):
+            raise ValueError('job must be a JSON object of flag values')
+        for name in job:
+            if name not in baseline or name in _SERVER_FIXED_FLAGS:
+                raise ValueError(f'unsupported job field: {name}')
+        for name, value in baseline.items():
+            FLAGS[name].value = value
+        for name, value in job.items():
+            # parse() applies the flag's type, bounds and enum checks, so bad
+            # job values are rejected instead of forwarded to Boltz
+            if value is None:
+                FLAGS[name].value = None
+            else:
+                FLAGS[name].parse(value)
+        FLAGS.validate_all_flags()
+        return {'returncode': run_command(_build_boltz_command(sif_path), FLAGS.log_file)}
+    except SystemExit as e: # Raised by the bind/validation helpers on bad paths
+        return {'error': f'job rejected (exit status {e.code})'}
     except Exception as e:
-        logging.error(f"Error executing Singularity command: {e}")
+        return {'error': str(e)}
+
+
+def _serve(socket_path: str, sif_path: str) -> None:
+    """Run Boltz jobs submitted over a Unix socket until interrupted.
+
+    Each connection sends one JSON object of flag overrides terminated by a
+    newline (e.g. {"input_data": "/data/a.fasta", "out_dir": "/results/a"}).
+    Flags a job does not mention keep the values given on the server command
+    line. Jobs run one at a time; the reply is a single JSON line sent once the
+    job finishes.
+
+    Args:
+        socket_path: Filesystem path of the Unix socket to listen on.
+        sif_path: Path to the Boltz Singularity image, loaded once for all jobs.
+    """
+    baseline = FLAGS.flag_values_dict()
+    if os.path.exists(socket_path): # Left behind by a previous server
+        os.unlink(socket_path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        server.listen()
+        logging.info('Listening for Boltz jobs on %s', socket_path)
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn, conn.makefile('rb') as reader:
+                    reply = _run_job(reader.readline(), baseline, sif_path)
+                    logging.info('Job finished: %s', reply)
+                    conn.sendall(json.dumps(reply).encode() + b'\n')
+        finally:
+            os.unlink(socket_path)
+
+
+def main(argv):
+    if len(argv) > 1:
+        raise app.UsageError('Too many command-line arguments.')
+
+    sif_path = FLAGS.sif_path if FLAGS.sif_path else _BOLTZ_SIF_PATH
+    try:
+        load_image(sif_path) # Validate the image before preparing the run
+    except FileNotFoundError: # load_image stats the file first
+        print(f"Error: Singularity image not found at '{sif_path}'.")
+        print("Please set BOLTZ_SIF, update _BOLTZ_SIF_PATH, or use --sif_path.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error loading Singularity image '{sif_path}': {e}")
         sys.exit(1)
 
+    logging.info('Using Singularity image: %s', sif_path)
+    logging.info('Host temporary directory: %s', tmp_dir_host)
+    logging.info('Default base output directory: %s', output_dir_default)
+    logging.info('Default Boltz cache directory: %s', _BOLTZ_CACHE_DEFAULT)
+
+    if FLAGS.server_mode:
+        _serve(normalize_path(FLAGS.server_mode), sif_path)
+        return
+
+    singularity_command = _build_boltz_command(sif_path)
+    try:
+        returncode = run_command(singularity_command, FLAGS.log_file)
+    except OSError as e:
+        logging.error('Error executing Singularity command: %s', e)
+        sys.exit(1)
+    if returncode != 0:
+        logging.error('Singularity command exited with status %d', returncode)
+        sys.exit(returncode)
+
     logging.info('Boltz prediction finished.')
 
 
@@ -300,7 +369,16 @@ if __name__ == '__main__':
     flags.DEFINE_boolean(
         'enable_potentials', True, 'Use potentials for steering? Appends --potentials or --no_potentials.')
 
-    # Mark required flags
-    flags.mark_flag_as_required('input_data')
+    flags.DEFINE_string(
+        'log_file', None,
+        'Optional file that also receives the container output (stdout and stderr).')
+
+    flags.DEFINE_string(
+        'server_mode', None,
+        'If set, listen on this Unix socket path for jobs instead of running once. '
+        'Each job is a JSON object of flag overrides (e.g. input_data, out_dir).')
+
+    # --input_data is required unless --server_mode is set; checked when the
+    # Boltz command is built.
 
     app.run(main) 
\ No newline at end of file
@@ -3,22 +3,16 @@
 
 import os
 import sys
-import pathlib
-import signal
 from typing import List, Tuple, Optional
-import multiprocessing
-import datetime
 
 from absl import app
 from absl import flags
 from absl import logging
-try:
-    from spython.main import Client
-except ImportError:
-    print("Error: spython library not found. Please install it: pip install spython")
-    sys.exit(1)
 
-import tempfile
+# Helpers shared by all launchers live in <repo>/common.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from launcher_utils import (canonical_paths, coalesce_binds, create_bind, load_image, make_host_dirs,
+                            non_default_args, normalize_path, remap_arg, run_command)
 
 #### USER CONFIGURATION ####
 
@@ -46,161 +40,145 @@ output_dir_default = os.path.join(os.getcwd(), 'chailab_output')
 _ROOT_MOUNT_DIRECTORY = '/mnt/'
 FLAGS = flags.FLAGS
 
-def _create_bind(mount_point_name: str, host_path: str, is_dir: bool = True) -> Tuple[str, str]:
-    """Create a bind mount specification for Singularity.
-
-    Args:
-        mount_point_name: A descriptive name for the mount point (used for target path).
-        host_path: The absolute path on the host system.
-        is_dir: Whether the host_path is a directory.
-
-    Returns:
-        A tuple containing:
-          - The bind string for Singularity ('host_path:target_path').
-          - The corresponding path inside the container.
+# Container path of every mount point the launcher binds.
+_MOUNT_TARGETS = {name: _ROOT_MOUNT_DIRECTORY + name
+                  for name in ('fasta', 'output', 'msa_dir', 'constraints', 'template_hits', 'tmp')}
+
+# chai-lab fold options forwarded only when they differ from the chai-lab default.
+# Each entry is (launcher flag name, chai-lab default, CLI template); boolean
+# switches use a template without a placeholder.
+_CHAI_FOLD_FLAGS = (
+    ('use_esm_embeddings', True, '--use-esm-embeddings=false'),
+    ('use_msa_server', False, '--use-msa-server'),
+    ('use_templates_server', False, '--use-templates-server'),
+    ('low_memory', True, '--low-memory=false'),
+    ('msa_server_url', 'https://api.colabfold.com', '--msa-server-url={}'),
+    ('recycle_msa_subsample', 0, '--recycle-msa-subsample={}'),
+    ('num_trunk_recycles', 3, '--num-trunk-recycles={}'),
+    ('num_diffn_timesteps', 200, '--num-diffn-timesteps={}'),
+    ('num_diffn_samples', 5, '--num-diffn-samples={}'),
+    ('num_trunk_samples', 1, '--num-trunk-samples={}'),
+    ('seed', None, '--seed={}'),
+    ('device', None, '--device={}'),
+)
+
+
+def _create_bind(mount_point_name: str, host_path: str, is_dir: bool = True,
+                 pending_dirs: Optional[List[str]] = None) -> Tuple[str, str]:
+    """Create a Chai Lab bind mount under _ROOT_MOUNT_DIRECTORY (see launcher_utils.create_bind).
+
+    Output and tmp directories are created on the host if missing; for input
+    files, the directory containing them must already exist.
     """
-    host_path = os.path.abspath(host_path)
-    target_base = os.path.join(_ROOT_MOUNT_DIRECTORY, mount_point_name)
-
-    if is_dir:
-        source_path = host_path
-        target_path = target_base
-        container_path = target_path
-    else: # it's a file
-        source_path = os.path.dirname(host_path)
-        target_path = target_base # Mount the directory containing the file
-        container_path = os.path.join(target_path, os.path.basename(host_path))
-
-
-    # Create target directory on host if it doesn't exist for output/tmp
-    # For input files, the source_path (directory part) must exist.
-    if mount_point_name.startswith('output') or mount_point_name == 'tmp':
-       os.makedirs(source_path, exist_ok=True)
-    elif not os.path.exists(source_path):
-        logging.error(f"Host path for binding does not exist: {source_path} (for mount {mount_point_name})")
-        sys.exit(1)
-
-
-    bind_spec = f'{source_path}:{target_path}'
-    logging.info('Binding %s -> %s (container path: %s)', source_path, target_path, container_path)
-    return (bind_spec, container_path)
+    create = mount_point_name.startswith('output') or mount_point_name == 'tmp'
+    return create_bind(_MOUNT_TARGETS[mount_point_name], mount_point_name, host_path, is_dir=is_dir,
+                       create=create, pending_dirs=pending_dirs)
 
 
 def main(argv):
     if len(argv) > 1:
         raise app.UsageError('Too many command-line arguments.')
 
+    # Read every flag once; plain dict lookups are cheaper than FLAGS attributes.
+    flag_values = FLAGS.flag_values_dict()
+
     # Check SIF path after flags are parsed, so it can be overridden
-    sif_path = FLAGS.sif_path if FLAGS.sif_path else _CHAI_SIF_PATH
-    if not os.path.exists(sif_path):
+    sif_path = flag_values['sif_path'] if flag_values['sif_path'] else _CHAI_SIF_PATH
+    try:
+        load_image(sif_path) # Validate the image before preparing the run
+    except FileNotFoundError: # load_image stats the file first
         print(f"Error: Singularity image not found at '{sif_path}'.")
         print("Please set the CHAI_SIF environment variable, update the _CHAI_SIF_PATH in this script, or use the --sif_path flag.")
         sys.exit(1)
-    
-    try:
-        singularity_image = Client.load(sif_path)
     except Exception as e:
         print(f"Error loading Singularity image '{sif_path}': {e}")
         sys.exit(1)
 
-    logging.info(f'INFO: Using Singularity image: {sif_path}')
-    logging.info(f'INFO: Host temporary directory: {tmp_dir}')
-    logging.info(f'INFO: Default base output directory: {output_dir_default}')
+    logging.info('Using Singularity image: %s', sif_path)
+    logging.info('Host temporary directory: %s', tmp_dir)
+    logging.info('Default base output directory: %s', output_dir_default)
 
 
     # --- Argument validation ---
-    if not FLAGS.fasta_file:
+    if not flag_values['fasta_file']:
         raise app.UsageError('Missing required argument: --fasta_file')
-    if not FLAGS.output_dir:
+    if not flag_values['output_dir']:
         raise app.UsageError('Missing required argument: --output_dir')
 
 
+    # Normalize every host path once; the bind helpers take them as is.
+    paths = canonical_paths(flag_values, ('fasta_file', 'output_dir', 'msa_directory',
+                                          'constraint_path', 'template_hits_path'))
+    paths['tmp'] = normalize_path(tmp_dir)
+
     # --- Prepare Singularity Bind Mounts ---
     binds = []
+    host_dirs = [] # Created together once all binds are known
     chai_command_args = []
 
     # FASTA file
-    bind_spec, container_fasta_file = _create_bind('fasta', FLAGS.fasta_file, is_dir=False)
+    bind_spec, container_fasta_file = _create_bind('fasta', paths['fasta_file'], is_dir=False)
     binds.append(bind_spec)
     # chai-lab fold expects fasta_file as a positional argument
 
     # Output directory
     # Ensure the output directory handling is correct, especially with force_output_dir
-    actual_output_dir = FLAGS.output_dir
-    if os.path.exists(actual_output_dir) and os.listdir(actual_output_dir) and not FLAGS.force_output_dir:
+    actual_output_dir = paths['output_dir']
+    if os.path.exists(actual_output_dir) and os.listdir(actual_output_dir) and not flag_values['force_output_dir']:
+        import datetime # Only needed for this branch
         timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
         actual_output_dir = os.path.join(actual_output_dir, f'run_{timestamp}')
         logging.warning(
-            f"Output directory {FLAGS.output_dir} is not empty. "
-            f"Using timestamped subdirectory: {actual_output_dir}"
+            'Output directory %s is not empty. Using timestamped subdirectory: %s',
+            flag_values['output_dir'], actual_output_dir
         )
-    os.makedirs(actual_output_dir, exist_ok=True)
-    
-    bind_spec, container_output_dir = _create_bind('output', actual_output_dir, is_dir=True)
+
+    bind_spec, container_output_dir = _create_bind('output', actual_output_dir, is_dir=True, pending_dirs=host_dirs)
     binds.append(bind_spec)
     # chai-lab fold expects output_dir as a positional argument
 
 
     # Optional path arguments that need binding
-    if FLAGS.msa_directory:
-        bind_spec, container_msa_dir = _create_bind('msa_dir', FLAGS.msa_directory, is_dir=True)
+    if flag_values['msa_directory']:
+        bind_spec, container_msa_dir = _create_bind('msa_dir', paths['msa_directory'], is_dir=True)
         binds.append(bind_spec)
         chai_command_args.append(f'--msa-directory={container_msa_dir}')
 
-    if FLAGS.constraint_path:
-        bind_spec, container_constraint_path = _create_bind('constraints', FLAGS.constraint_path, is_dir=False)
+    if flag_values['constraint_path']:
+        bind_spec, container_constraint_path = _create_bind('constraints', paths['constraint_path'], is_dir=False)
         binds.append(bind_spec)
         chai_command_args.append(f'--constraint-path={container_constraint_path}')
 
-    if FLAGS.template_hits_path:
-        bind_spec, container_template_hits = _create_bind('template_hits', FLAGS.template_hits_path, is_dir=False)
+    if flag_values['template_hits_path']:
+        bind_spec, container_template_hits = _create_bind('template_hits', paths['template_hits_path'], is_dir=False)
         binds.append(bind_spec)
         chai_command_args.append(f'--template-hits-path={container_template_hits}')
     
     # Temporary directory
-    bind_spec, container_tmp_dir = _create_bind('tmp', tmp_dir, is_dir=True)
+    bind_spec, container_tmp_dir = _create_bind('tmp', paths['tmp'], is_dir=True, pending_dirs=host_dirs)
     binds.append(bind_spec)
     # Singularity typically inherits TMPDIR, but binding explicitly can be safer.
     # Chai might also use this.
 
+    make_host_dirs(host_dirs)
+
     # --- Construct Chai Command ---
     # Base command: chai-lab fold <fasta_file> <output_dir>
     chai_exec_command = ['chai-lab', 'fold', container_fasta_file, container_output_dir]
 
-    # Add boolean flags (only if True or if different from default where applicable)
-    if FLAGS.use_esm_embeddings is False: # Default is True for chai-lab
-        chai_command_args.append('--use-esm-embeddings=false')
-    if FLAGS.use_msa_server: # Default is False
-        chai_command_args.append('--use-msa-server')
-    if FLAGS.use_templates_server: # Default is False
-        chai_command_args.append('--use-templates-server')
-    if FLAGS.low_memory is False: # Default is True for chai-lab
-        chai_command_args.append('--low-memory=false')
-
-    # Add flags with values
-    if FLAGS.msa_server_url != "https://api.colabfold.com": # Default for chai-lab
-        chai_command_args.append(f'--msa-server-url={FLAGS.msa_server_url}')
-    if FLAGS.recycle_msa_subsample != 0: # Default for chai-lab
-        chai_command_args.append(f'--recycle-msa-subsample={FLAGS.recycle_msa_subsample}')
-    if FLAGS.num_trunk_recycles != 3: # Default for chai-lab
-        chai_command_args.append(f'--num-trunk-recycles={FLAGS.num_trunk_recycles}')
-    if FLAGS.num_diffn_timesteps != 200: # Default for chai-lab
-        chai_command_args.append(f'--num-diffn-timesteps={FLAGS.num_diffn_timesteps}')
-    if FLAGS.num_diffn_samples != 5: # Default for chai-lab
-        chai_command_args.append(f'--num-diffn-samples={FLAGS.num_diffn_samples}')
-    if FLAGS.num_trunk_samples != 1: # Default for chai-lab
-        chai_command_args.append(f'--num-trunk-samples={FLAGS.num_trunk_samples}')
-    if FLAGS.seed is not None:
-        chai_command_args.append(f'--seed={FLAGS.seed}')
-    if FLAGS.device: # chai-lab device flag
-        chai_command_args.append(f'--device={FLAGS.device}')
+    chai_command_args.extend(non_default_args(_CHAI_FOLD_FLAGS, flag_values))
 
     full_chai_command = chai_exec_command + chai_command_args
 
+    # Reuse an existing mount for binds nested inside it (e.g. inputs in one dir)
+    binds, bind_remap = coalesce_binds(binds)
+    full_chai_command = [remap_arg(arg, bind_remap) for arg in full_chai_command]
+    container_tmp_dir = remap_arg(container_tmp_dir, bind_remap)
+
     # --- Prepare Singularity Options ---
     singularity_options = [
-        '--bind', f'{",".join(binds)}',
-        '--env', f'NVIDIA_VISIBLE_DEVICES={FLAGS.gpu_devices}',
+        '--bind', ','.join(binds),
+        '--env', f'NVIDIA_VISIBLE_DEVICES={flag_values["gpu_devices"]}',
         # Consider adding other env vars if Chai benefits from them, e.g.
         # '--env', 'XLA_PYTHON_CLIENT_MEM_FRACTION=0.9',
         # '--env', 'TF_FORCE_GPU_ALLOW_GROWTH=true',
@@ -210,28 +188,28 @@ def main(argv):
 
 
     # --- Execute Singularity Command ---
-    logging.info('Running Singularity command:')
-    logging.info(f'Image: {sif_path}')
-    logging.info(f'Singularity Options: {singularity_options}')
-    logging.info(f'Chai Command: {" ".join(full_chai_command)}')
+    if logging.level_info(): # Skip formatting the long command lines when not logged
+        logging.info('Running Singularity command:')
+        logging.info('Image: %s', sif_path)
+        logging.info('Singularity Options: %s', singularity_options)
+        logging.info('Chai Command: %s', ' '.join(full_chai_command))
 
-    try:
-        result = Client.execute(
-                 singularity_image,
-                 full_chai_command,
-                 nv=FLAGS.use_gpu,
-                 options=singularity_options,
-                 stream=True # Stream stdout/stderr
-               )
-        for line in result:
-            print(line, end='') # Print container output in real-time
+    singularity_command = ['singularity', 'exec']
+    if flag_values['use_gpu']:
+        singularity_command.append('--nv')
+    singularity_command += singularity_options + [sif_path] + full_chai_command
 
-    except Exception as e:
-        logging.error(f"Error executing Singularity command: {e}")
+    try:
+        returncode = run_command(singularity_command, flag_values['log_file'])
+    except OSError as e:
+        logging.error('Error executing Singularity command: %s', e)
         # Attempt to clean up output dir if it was created by this script and is empty
         # This is a bit more complex if we created a timestamped one
         # For simplicity, just log the error. A more robust cleanup might be needed.
         sys.exit(1)
+    if returncode != 0:
+        logging.error('Singularity command exited with status %d', returncode)
+        sys.exit(returncode)
 
     logging.info('Chai Lab prediction finished.')
 
@@ -297,6 +275,10 @@ if __name__ == '__main__':
     flags.DEFINE_boolean(
         'low_memory', True, '(Chai default: True) Whether to use low memory mode.')
     
+    flags.DEFINE_string(
+        'log_file', None,
+        'Optional file that also receives the container output (stdout and stderr).')
+
     # Mark required flags
     flags.mark_flag_as_required('fasta_file')
     # output_dir has a default, so not strictly required from user but essential for script
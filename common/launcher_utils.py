@@ -0,0 +1,251 @@
+"""Helpers shared by the AlphaFold 3, Boltz and Chai Lab Singularity launch scripts.
+
+The launchers add this directory to sys.path, so it must stay next to the model
+directories (e.g. alphafold3/, boltz/, chai_1/) in the repository checkout.
+"""
+
+import functools
+import math
+import os
+import stat
+import subprocess
+import sys
+from typing import Dict, List, Tuple, Optional
+
+from absl import logging
+
+
+def non_default_args(flag_specs: Tuple[Tuple[str, object, str], ...],
+                     flag_values: Dict[str, object]) -> List[str]:
+    """Format the CLI arguments for every flag that differs from its default.
+
+    Args:
+        flag_specs: Sequence of (flag name, default value, CLI template) records.
+            Float defaults are compared with a 1e-6 tolerance.
+        flag_values: Parsed flag values, as returned by FLAGS.flag_values_dict().
+
+    Returns:
+        The formatted arguments, in the order of flag_specs. Unset (None or
+        empty) flags are skipped.
+    """
+    args = []
+    for name, default, template in flag_specs:
+        value = flag_values[name]
+        if value is None or value == '':
+            continue
+        if isinstance(default, float):
+            if math.isclose(value, default, rel_tol=0.0, abs_tol=1e-6): # Comparing floats
+                continue
+        elif value == default:
+            continue
+        args.append(template.format(value))
+    return args
+
+
+@functools.lru_cache(maxsize=64)
+def normalize_path(path: str) -> str:
+    """Return the absolute, user-expanded form of path (memoized per launch)."""
+    return os.path.abspath(os.path.expanduser(path))
+
+
+def canonical_paths(flag_values: Dict[str, object], names: Tuple[str, ...]) -> Dict[str, Optional[str]]:
+    """Normalize each path-valued flag in names once; unset flags are kept as is.
+
+    Args:
+        flag_values: Parsed flag values, as returned by FLAGS.flag_values_dict().
+        names: Names of the flags holding host paths.
+
+    Returns:
+        A mapping from flag name to its normalized path (or its unset value).
+    """
+    return {name: normalize_path(flag_values[name]) if flag_values[name] else flag_values[name]
+            for name in names}
+
+
+@functools.lru_cache(maxsize=64)
+def probe(path: str) -> Tuple[bool, bool, bool]:
+    """Stat path once and report (exists, is_dir, is_file), memoized per launch."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (False, False, False)
+    return (True, stat.S_ISDIR(st.st_mode), stat.S_ISREG(st.st_mode))
+
+
+def create_bind(target_base: str, mount_point_name: str, host_path: str,
+                is_dir: bool = True, read_only: bool = False, create: bool = False,
+                pending_dirs: Optional[List[str]] = None) -> Tuple[str, str]:
+    """Create a bind mount specification for Singularity.
+
+    Args:
+        target_base: Container path the bind is mounted at (precomputed by the
+            launcher for each of its fixed mount points).
+        mount_point_name: A descriptive name for the mount point (used in messages).
+        host_path: The absolute, normalized path on the host system (see
+            normalize_path and canonical_paths).
+        is_dir: Whether the host_path is a directory.
+        read_only: Whether to mount as read-only (appends ':ro').
+        create: Whether the host directory should be created if missing (for
+            output/tmp/cache mounts). Otherwise it must already exist.
+        pending_dirs: If given, host directories that need creating are appended
+            here for make_host_dirs instead of being created immediately.
+
+    Returns:
+        A tuple containing:
+          - The bind string for Singularity ('host_path:target_path[:ro]').
+          - The corresponding path inside the container.
+    """
+    if is_dir:
+        source_path = host_path
+        container_path = target_base
+    else: # it's a file
+        # We bind the directory containing the file, and adjust container path
+        source_path = os.path.dirname(host_path)
+        container_path = f"{target_base}/{host_path.rsplit('/', 1)[-1]}"
+
+    if create:
+        if pending_dirs is not None:
+            pending_dirs.append(source_path)
+        elif not os.path.isdir(source_path):
+            os.makedirs(source_path, exist_ok=True)
+    elif not probe(source_path)[0]:
+        logging.error('Host path for binding does not exist: %s (for mount %s)', source_path, mount_point_name)
+        sys.exit(1)
+
+    bind_spec = f'{source_path}:{target_base}'
+    if read_only:
+        bind_spec += ':ro'
+
+    logging.info('Binding %s -> %s (container path: %s, read_only: %s)',
+                 source_path, target_base, container_path, read_only)
+    return (bind_spec, container_path)
+
+
+def coalesce_binds(binds: List[str]) -> Tuple[List[str], Dict[str, str]]:
+    """Drop binds whose host directory is already covered by another bind.
+
+    A bind is folded into another when its source equals, or lies inside, the
+    other bind's source and both have the same read-only mode. Binds are never
+    widened to a new common ancestor, so nothing beyond the requested host
+    paths becomes visible in the container.
+
+    Args:
+        binds: Bind strings ('host_path:target_path[:ro]') as built by create_bind.
+
+    Returns:
+        A tuple containing:
+          - The remaining bind strings, in their original order.
+          - A mapping from each dropped container target to the equivalent path
+            under the bind that now covers it.
+    """
+    parsed = [tuple(spec.split(':', 2)) for spec in binds]
+    kept = []
+    remap = {}
+    # Visit shorter sources first so that parents are kept before their children.
+    for index in sorted(range(len(parsed)), key=lambda i: len(parsed[i][0])):
+        source, target, *mode = parsed[index]
+        for kept_index in kept:
+            kept_source, kept_target, *kept_mode = parsed[kept_index]
+            if mode != kept_mode:
+                continue
+            if source == kept_source or source.startswith(kept_source.rstrip('/') + '/'):
+                remap[target] = kept_target + source[len(kept_source.rstrip('/')):]
+                logging.info('Bind %s is covered by %s; reusing %s', source, kept_source, kept_target)
+                break
+        else:
+            kept.append(index)
+    return [binds[i] for i in sorted(kept)], remap
+
+
+def remap_arg(arg: str, remap: Dict[str, str]) -> str:
+    """Rewrite a container path, or the value of a 'key=path' argument, using remap."""
+    key, sep, value = arg.rpartition('=')
+    for old, new in remap.items():
+        if value == old or value.startswith(old + '/'):
+            return key + sep + new + value[len(old):]
+    return arg
+
+
+def make_host_dirs(paths: List[str]) -> None:
+    """Create the host directories collected by create_bind in a single pass.
+
+    Duplicates, paths that already exist, and ancestors of another requested
+    path (os.makedirs creates those on the way) are skipped, so each missing
+    directory tree costs one makedirs call.
+
+    Args:
+        paths: Normalized host directory paths to create.
+    """
+    leaves = []
+    for path in sorted(set(paths), reverse=True):
+        if not any(leaf.startswith(path.rstrip(os.sep) + os.sep) for leaf in leaves):
+            leaves.append(path)
+    for path in leaves:
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+
+
+def load_image(sif_path: str):
+    """Check that a Singularity image exists and load it with spython.
+
+    Args:
+        sif_path: Path to the .sif file on the host.
+
+    Returns:
+        The spython image object for sif_path.
+
+    Raises:
+        FileNotFoundError: If sif_path does not exist.
+    """
+    os.stat(sif_path) # Raises FileNotFoundError for a missing image
+    try:
+        from spython.main import Client
+    except ImportError:
+        print("Error: spython library not found. Please install it: pip install spython")
+        sys.exit(1)
+    return Client.load(sif_path)
+
+
+def run_and_tee(command: List[str], log_path: str) -> int:
+    """Run command, copying its combined stdout/stderr to our stdout and log_path.
+
+    Output is relayed in raw 64 KiB chunks and never decoded or split into lines.
+
+    Args:
+        command: The command line to execute.
+        log_path: File that receives a copy of the output (truncated first).
+
+    Returns:
+        The exit status of the command.
+    """
+    with open(log_path, 'wb', buffering=0) as log_file:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        with process.stdout:
+            pipe_fd = process.stdout.fileno()
+            while True:
+                chunk = os.read(pipe_fd, 65536)
+                if not chunk:
+                    break
+                sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
+                log_file.write(chunk)
+        return process.wait()
+
+
+def run_command(command: List[str], log_path: Optional[str] = None) -> int:
+    """Run a container command, passing its output through without Python relaying.
+
+    Without log_path the child inherits our stdout/stderr file descriptors, so it
+    writes straight to the terminal (or wherever they point). With log_path the
+    output is also copied to that file via run_and_tee.
+
+    Args:
+        command: The command line to execute.
+        log_path: Optional file that receives a copy of the output.
+
+    Returns:
+        The exit status of the command.
+    """
+    if log_path:
+        return run_and_tee(command, normalize_path(log_path))
+    return subprocess.run(command, stdin=None, stdout=None, stderr=None, check=False).returncode